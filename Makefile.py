@@ -1,17 +1,17 @@
 import datetime
 import json
-import mistune
 import os
 import os.path
-import shutil
 
 from pathlib import Path
-from subprocess import check_output
-from zipfile import ZipFile
 
 from metapack.candy import singleton
-from metapack.glitchtex import glitch
 from metapack.mods import ModRules
+from metapack.staging import stage_file, write_if_changed
+
+# mistune, metapack.aseprite, metapack.glitchtex & metapack.packzip (and so
+# numpy & png) are imported inside the rules that use them. loading the
+# makefile shouldn't cost more than it has to
 
 PACK_INFO = {
     'name': "FAITHLESS",
@@ -23,6 +23,12 @@ PACK_INFO = {
 }
 
 ASEPRITE = os.environ.get('ASEPRITE', 'aseprite')
+# how files are copied into the build: 'auto' tries a reflink, then a hard
+# link, then copies. see metapack.staging
+STAGING = os.environ.get('STAGING', 'auto')
+# 'native' reads .ase files ourselves & only runs aseprite for sprites we
+# can't render; 'aseprite' always runs it
+ASEPRITE_EXPORT = os.environ.get('ASEPRITE_EXPORT', 'native')
 
 BUILD_DIR = Path('build')
 WOOD_TYPES = ['oak', 'birch', 'spruce']
@@ -72,54 +78,81 @@ class mekanism(ModRules):
 #     ingot  = 'items/materials/ingot_{!L}'
 #     block  = 'blocks/block_{!L}'
 
-# @metapack.task()
-# def show_missing(mod=None):
-#     def checklist(filename):
-#         with open(filename, 'r') as checklist:
-#             for item in filter(Path.exists, map(str.strip, checklist)):
-#                 print(item)
-#
-#     if mod:
-#         checklist(f'checklist/{mod}.txt')
-#     else:
-#         for filename in Path('checklist').glob('*.txt'):
-#             checklist(filename)
-
 @rule()
-@deps('generate_models', 'export_textures', 'bedrock', 'copy_files', 'build/pack.mcmeta')
+@deps('generate_models', 'export_textures', 'bedrock', 'copy_files', 'build/pack.mcmeta', 'build/aliases.json')
 def build():
     pass
 
 @rule()
 @deps('build', 'pack.png', 'README.md')
 def package():
-    pack_filename = '{name}-{version}.zip'.format(**PACK_INFO)
-    with ZipFile(pack_filename, 'w') as z:
-        z.write('build/pack.mcmeta', 'pack.mcmeta')
-        z.write('pack.png')
-
-        with open('README.md') as f:
-            html = mistune.markdown(f.read())
-            z.writestr('README.html', html)
+    import mistune
+    from metapack.packzip import report, update_zip
 
-        z.write('build/assets', 'assets')
-        for src in Path('build/assets').rglob('*'):
-            dst = src.relative_to('build')
-            z.write(src, dst)
+    pack_filename = '{name}-{version}.zip'.format(**PACK_INFO)
+    with open('README.md') as f:
+        html = mistune.markdown(f.read())
+
+    members = {}
+    for src in Path('build/assets').rglob('*'):
+        if src.is_file():
+            members[src.relative_to('build').as_posix()] = str(src)
+    # the aliases aren't staged; the zip gets the texture they copy under
+    # each of their names instead
+    with open(BUILD_DIR/'aliases.json') as f:
+        for dst, src in json.load(f).items():
+            members[dst] = str(BUILD_DIR/src)
+    for name in list(members):
+        parent = name.rpartition('/')[0]
+        while parent and parent + '/' not in members:
+            members[parent + '/'] = None
+            parent = parent.rpartition('/')[0]
+
+    sources = [
+        ('pack.mcmeta', 'build/pack.mcmeta'),
+        ('pack.png', 'pack.png'),
+        ('README.html', html.encode()),
+        *sorted(members.items()),
+    ]
+
+    stats = update_zip(pack_filename, sources, index=BUILD_DIR/'package-index.json')
+    lines = list(report(stats.entries))
+    with open(BUILD_DIR/'package-report.txt', 'w') as f:
+        for line in lines:
+            print(line, file=f)
+    print(f"{pack_filename}: {stats.written} written, {stats.reused} unchanged, {stats.dropped} dropped")
+    # the last line of the report is the total
+    print(lines[-1])
+
+def checklist_coverage():
+    from metapack.coverage import add_aliases, coverage, index_tree, read_checklists
+
+    index = index_tree('assets')
+    # textures the mods get from assets/common count too, if they're there
+    add_aliases(index, (pair for mod in MODS for pair in mod.files))
+    return coverage(read_checklists('checklist'), index)
 
 @rule()
 def whats_missing():
-    for line in open('checklist/minecraft.txt'):
-        texture = Path(line.strip())
-        if not (texture.with_suffix('.png').exists() or
-                texture.with_suffix('.ase').exists()):
+    for mod, dirs in checklist_coverage().values():
+        for texture in mod.missing:
             print(texture)
 
+@rule()
+def coverage():
+    from metapack.coverage import report, to_json
+
+    results = checklist_coverage()
+    for line in report(results):
+        print(line)
+    BUILD_DIR.mkdir(exist_ok=True)
+    with open(BUILD_DIR/'coverage.json', 'w') as f:
+        json.dump(to_json(results), f, indent=2)
+
 
 @rule('build/pack.mcmeta')
 def generate_pack_mcmeta(target):
-    with open(target, 'w') as f:
-        json.dump({ 'pack': PACK_INFO }, f)
+    write_if_changed(target, json.dumps({ 'pack': PACK_INFO }))
 
 @rule()
 def export_textures():
@@ -150,80 +183,100 @@ def _if_exists(filename):
     else:
         return None
 
-@match('assets/*/textures/**/*.ase')
-def texture_matcher(src):
-    @export_textures.depends_on
-    @rule(BUILD_DIR/src.with_suffix('.png'),
-        BUILD_DIR/src.with_suffix('.png.mcmeta'))
-    @deps(src, *filter(os.path.exists, [src.with_suffix('.ase.json')]))
-    def aseprite_export_rule(targets, deps):
-        output = check_output([ASEPRITE, '-b', deps[0],
-            '--sheet', targets[0],
-            # '--data', dst + '.json',
-            '--sheet-type', 'columns',
-            '--format', 'json-array',
-            '--list-tags',
-            '--list-layers',
-            '--list-slices'])
+@batch_rule()
+@cached('metapack.aseprite', aseprite_to_mcmeta)
+@bind_params(mode=ASEPRITE_EXPORT, aseprite=ASEPRITE)
+async def export_sprites(items, mode, aseprite):
+    import asyncio
+    from metapack.aseprite import UnsupportedSprite, export_sheet
+
+    # sprites we can render are exported on as many threads as `-j` allows;
+    # the rest wait on aseprite, as many at once as `-p` allows
+    async def export(targets, deps):
+        anim = None
+        if mode == 'native':
+            try:
+                anim = await makefile.loop.to_thread(export_sheet, deps[0], targets[0])
+            except UnsupportedSprite:
+                pass
+        if anim is None:
+            anim = json.loads(await makefile.loop.check_output([aseprite, '-b', deps[0],
+                '--sheet', targets[0],
+                # '--data', dst + '.json',
+                '--sheet-type', 'columns',
+                '--format', 'json-array',
+                '--list-tags',
+                '--list-layers',
+                '--list-slices']))
 
         if len(deps) > 1 and os.path.exists(deps[1]):
             with open(deps[1]) as f:
                 mcmeta = json.load(f)
         else:
             mcmeta = {}
-        aseprite_to_mcmeta(json.loads(output), mcmeta)
-        with open(targets[1], 'w') as f:
-            json.dump(mcmeta, f)
+        aseprite_to_mcmeta(anim, mcmeta)
+        write_if_changed(targets[1], json.dumps(mcmeta))
+
+    await asyncio.gather(*(export(item.targets, item.deps) for item in items))
+
+# bedrock is different every release, but the same every time a release is built
+BEDROCK_SEED = os.environ.get('BEDROCK_SEED', PACK_INFO['version'])
 
 @rule()
 @deps('export_textures')
 def bedrock():
     pass
-    # texture_path = BUILD_DIR/'assets/minecraft/textures/blocks'
-    # os.makedirs(texture_path/'bedrock', exist_ok=True)
-    # for idx in range(16):
-    #     filename = texture_path / f'bedrock/{idx:02x}.png'
-    #     glitch(filename, list(filter(lambda p: p.endswith('.png'), export_textures.deps)))
-
-def make_bedrock_rules():
-    texture_path = BUILD_DIR/'assets/minecraft/textures/blocks'
-    def make_bedrock_texture_rule(idx):
-        @bedrock.depends_on
-        @rule(texture_path / f'bedrock/{idx:02x}.png')
-        def bedrock_rule(target):
-            tile_list = list(filter(
-                lambda p: p.endswith('.png'),
-                export_textures.deps))
-            glitch(target, tile_list)
-
-    for idx in range(16):
-        make_bedrock_texture_rule(idx)
-make_bedrock_rules()
+
+def make_bedrock_rule():
+    texture_path = BUILD_DIR/'assets/minecraft/textures/blocks/bedrock'
+    textures = [texture_path / f'{idx:02x}.png' for idx in range(16)]
+
+    # every exported texture is a tile; texture_matcher adds them as they're
+    # found, so sprites that turn up while watching are picked up too
+    @bedrock.depends_on
+    @rule(*textures, *(t.with_suffix('.png.mcmeta') for t in textures))
+    @cached('metapack.glitchtex')
+    @bind_params(seed=BEDROCK_SEED)
+    def bedrock_rule(targets, deps, seed):
+        from metapack.glitchtex import glitch_all
+        glitch_all(targets[:len(textures)], deps, seed)
+    return bedrock_rule
+bedrock_rule = make_bedrock_rule()
+
+@match('assets/*/textures/**/*.ase')
+def texture_matcher(src):
+    png = BUILD_DIR/src.with_suffix('.png')
+    export_textures.depends_on(export_sprites.add(
+        [png, BUILD_DIR/src.with_suffix('.png.mcmeta')],
+        [src, *filter(os.path.exists, [src.with_suffix('.ase.json')])]))
+    bedrock_rule.add_deps(png)
 
 @rule()
 def copy_files():
     pass
 
+@batch_rule()
+def stage_files(items):
+    for item in items:
+        stage_file(item.deps[0], item.targets[0], STAGING)
+
 @match('assets/**/*')
 @exclude('.DS_Store', '*.ase', '*.ase.json')
 def file_matcher(src):
     if src.is_file():
-        @copy_files.depends_on
-        @rule(BUILD_DIR/src)
-        @deps(src)
-        def copy_this_file(target, dep):
-            shutil.copyfile(dep, target)
-
-for mod in MODS:
-    for src, dst in mod.files:
-        src = str(BUILD_DIR/src)
-        dst = str(BUILD_DIR/dst)
-        if src in makefile.rules:
-            @copy_files.depends_on
-            @rule(dst)
-            @deps(src)
-            def copy_this_file(target, dep):
-                shutil.copyfile(dep, target)
+        copy_files.depends_on(stage_files.add([BUILD_DIR/src], [src]))
+
+def make_alias_manifest():
+    # every mod gets its own names for the textures in assets/common. they
+    # only go in the zip, so all that's written here is which is which
+    aliases = {dst: src for mod in MODS for src, dst in mod.files
+        if str(BUILD_DIR/src) in makefile.rules}
+
+    @rule(BUILD_DIR/'aliases.json')
+    @bind_params(aliases=aliases)
+    def alias_manifest_rule(target, aliases):
+        write_if_changed(target, json.dumps(aliases, indent=2, sort_keys=True))
+make_alias_manifest()
 
 @rule()
 def generate_models():
@@ -234,83 +287,83 @@ for material in ('birch', 'oak', 'spruce'):
 
     @generate_models.depends_on
     @rule(base/f'{material}_planks.json')
+    @cached()
     @bind_params(material=material)
     def planks_rule(target, material):
-        with open(target, 'w') as f:
-            f.write(json.dumps({
-                'parent': 'block/cube_column',
-                'textures': {
-                    'side': f'blocks/planks_{material}',
-                    'end': f'blocks/{material}/top'
-                }
-            }))
+        write_if_changed(target, json.dumps({
+            'parent': 'block/cube_column',
+            'textures': {
+                'side': f'blocks/planks_{material}',
+                'end': f'blocks/{material}/top'
+            }
+        }))
 
     @generate_models.depends_on
     @rule(base/f'{material}_outer_stairs.json')
+    @cached()
     @bind_params(material=material)
     def outer_stairs_rule(target, material):
-        with open(target, 'w') as f:
-            f.write(json.dumps({
-                'parent': 'block/outer_stairs',
-                'textures': {
-                    'bottom': f'blocks/{material}/top',
-                    'top': f'blocks/{material}/top',
-                    'side': f'blocks/{material}/stair_side'
-                }
-            }))
+        write_if_changed(target, json.dumps({
+            'parent': 'block/outer_stairs',
+            'textures': {
+                'bottom': f'blocks/{material}/top',
+                'top': f'blocks/{material}/top',
+                'side': f'blocks/{material}/stair_side'
+            }
+        }))
 
     @generate_models.depends_on
     @rule(base/f'{material}_inner_stairs.json')
+    @cached()
     @bind_params(material=material)
     def inner_stairs_rule(target, material):
-        with open(target, 'w') as f:
-            f.write(json.dumps({
-                'parent': 'block/inner_stairs',
-                'textures': {
-                    'bottom': f'blocks/{material}/top',
-                    'top': f'blocks/{material}/top',
-                    'side': f'blocks/{material}/stair_side'
-                }
-            }))
+        write_if_changed(target, json.dumps({
+            'parent': 'block/inner_stairs',
+            'textures': {
+                'bottom': f'blocks/{material}/top',
+                'top': f'blocks/{material}/top',
+                'side': f'blocks/{material}/stair_side'
+            }
+        }))
 
     @generate_models.depends_on
     @rule(base/f'{material}_stairs.json')
+    @cached()
     @bind_params(material=material)
     def stairs_rule(target, material):
-        with open(target, 'w') as f:
-            f.write(json.dumps({
-                'parent': 'block/stairs',
-                'textures': {
-                    'bottom': f'blocks/{material}/top',
-                    'top': f'blocks/{material}/top',
-                    'side': f'blocks/{material}/stair_side'
-                }
-            }))
+        write_if_changed(target, json.dumps({
+            'parent': 'block/stairs',
+            'textures': {
+                'bottom': f'blocks/{material}/top',
+                'top': f'blocks/{material}/top',
+                'side': f'blocks/{material}/stair_side'
+            }
+        }))
 
     @generate_models.depends_on
     @rule(base/f'half_slab_{material}.json')
+    @cached()
     @bind_params(material=material)
     def lower_slab_rule(target, material):
-        with open(target, 'w') as f:
-            f.write(json.dumps({
-                'parent': 'block/half_slab',
-                'textures': {
-                    'bottom': f'blocks/{material}/top',
-                    'top': f'blocks/{material}/top',
-                    'side': f'blocks/{material}/slab_side'
-                }
-            }))
+        write_if_changed(target, json.dumps({
+            'parent': 'block/half_slab',
+            'textures': {
+                'bottom': f'blocks/{material}/top',
+                'top': f'blocks/{material}/top',
+                'side': f'blocks/{material}/slab_side'
+            }
+        }))
 
     @generate_models.depends_on
     @rule(base/f'upper_slab_{material}.json')
+    @cached()
     @bind_params(material=material)
     def upper_slab_rule(target, material):
-        with open(target, 'w') as f:
-            f.write(json.dumps({
-                'parent': 'block/upper_slab',
-                'textures': {
-                    'bottom': f'blocks/{material}/top',
-                    'top': f'blocks/{material}/top',
-                    'side': f'blocks/{material}/slab_side'
-                }
-            }))
+        write_if_changed(target, json.dumps({
+            'parent': 'block/upper_slab',
+            'textures': {
+                'bottom': f'blocks/{material}/top',
+                'top': f'blocks/{material}/top',
+                'side': f'blocks/{material}/slab_side'
+            }
+        }))
@@ -0,0 +1,215 @@
+"""benchmark pancake itself, without any real work for the rules to do.
+
+generates a synthetic tree & makefile in a temporary directory: thousands of
+source files spread over nested directories, a matcher per top level
+directory (plus a few with exclusions), and every generated rule fanned into
+a couple of phony rules the way `build` & `copy_files` are. every action just
+writes an empty file, so whatever time is left is pancake's own.
+
+    python bench/engine.py [--files N] [--matchers N] [-o results.json]
+    python bench/engine.py --compare old.json new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pancake
+
+MAKEFILE = '''
+@rule()
+@deps('copy_files', 'convert_files')
+def build():
+    pass
+
+@rule()
+def copy_files():
+    pass
+
+@rule()
+def convert_files():
+    pass
+
+def copy_matcher(pattern, excluded):
+    @match(pattern)
+    @exclude(*excluded)
+    def copy(src):
+        @copy_files.depends_on
+        @rule('out/' + src.as_posix())
+        @deps(src)
+        def copy_rule(target, dep):
+            open(target, 'w').close()
+
+def convert_matcher(pattern):
+    @match(pattern)
+    def convert(src):
+        @convert_files.depends_on
+        @rule('out/' + src.with_suffix('.out').as_posix(), 'out/' + src.with_suffix('.meta').as_posix())
+        @deps(src)
+        def convert_rule(targets, dep):
+            for target in targets:
+                open(target, 'w').close()
+
+for i in range({matchers}):
+    copy_matcher(f'src/d{{i}}/**/*.txt', ['**/skip'] if i % 4 == 0 else [])
+    convert_matcher(f'src/d{{i}}/**/*.dat')
+'''
+
+def make_tree(root, files, matchers, depth):
+    """write `files` empty source files spread across `matchers` top level directories."""
+    for i in range(files):
+        parts = [f'd{i % matchers}'] + [f's{(i // matchers) % (n + 3)}' for n in range(depth)]
+        if i % 10 == 9:
+            parts.append('skip')
+        ext = '.dat' if i % 3 == 0 else '.txt'
+        dirname = os.path.join(root, 'src', *parts)
+        os.makedirs(dirname, exist_ok=True)
+        open(os.path.join(dirname, f'f{i}{ext}'), 'w').close()
+    with open(os.path.join(root, 'Makefile.py'), 'w') as f:
+        f.write(MAKEFILE.format(matchers=matchers))
+
+def load():
+    makefile = pancake.Makefile()
+    makefile.load('Makefile.py')
+    return makefile
+
+def reset(*paths):
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+def measure(repeat, setup, bench):
+    """time `bench(setup())` `repeat` times and return the timings in seconds."""
+    runs = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        bench(arg)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+def run_benchmarks(args):
+    results = {}
+
+    def record(name, runs, **extra):
+        results[name] = {'min': min(runs), 'median': statistics.median(runs), 'runs': runs, **extra}
+        print(f"{name:<16} {min(runs) * 1000:9.2f} ms  (median {statistics.median(runs) * 1000:.2f} ms)",
+            file=sys.stderr)
+
+    # the rule cache holds the files every matcher found, so loading with &
+    # without it are both worth knowing
+    record('load_cold', measure(args.repeat, lambda: reset('.pancake'), lambda _: load()))
+    record('load_warm', measure(args.repeat, lambda: None, lambda _: load()))
+
+    makefile = load()
+    rules = len(set(makefile.rules.values()))
+    files = [matcher_file for matcher in makefile.matchers for matcher_file in matcher.generated]
+    patterns = [matcher.pattern for matcher in makefile.matchers][:10]
+    record('pathmatch', measure(args.repeat, lambda: None,
+        lambda _: [pancake.pathmatch(f, p) for f in files for p in patterns]),
+        calls=len(files) * len(patterns))
+
+    def fresh_graph():
+        makefile.invalidate_graph()
+        return makefile
+    record('collect', measure(args.repeat, fresh_graph, lambda m: m._collect('build')), rules=rules)
+
+    def clean_build():
+        reset('out', '.pancake')
+        m = load()
+        return m, m._collect('build')
+
+    def invoke_queue(mq):
+        with quiet():
+            mq[0]._invoke_queue(mq[1], args.jobs)
+    record('invoke_queue', measure(args.repeat, clean_build, invoke_queue), jobs=args.jobs)
+
+    def noop_build():
+        m = load()
+        m.stats.clear()
+        m.causes = {}
+        return m, m._collect('build')
+    record('should_noop', measure(args.repeat, noop_build,
+        lambda mq: [mq[0].is_stale(rule) for rule in mq[1]]))
+
+    return {'rules': rules, 'files': len(files), 'results': results}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = json.load(f)['results']
+    with open(new_file) as f:
+        new = json.load(f)['results']
+    for name in new:
+        if name in old:
+            ratio = new[name]['min'] / old[name]['min']
+            print(f"{name:<16} {old[name]['min'] * 1000:9.2f} ms -> {new[name]['min'] * 1000:9.2f} ms  {ratio:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=5000,
+        help="number of source files (default: %(default)s)")
+    parser.add_argument('--matchers', type=int, default=40,
+        help="number of top level directories, each with two matchers (default: %(default)s)")
+    parser.add_argument('--depth', type=int, default=2,
+        help="how deep the source directories nest (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3,
+        help="runs per benchmark (default: %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help="workers for invoke_queue (default: %(default)s)")
+    parser.add_argument('-o', '--output',
+        help="write the results here as json instead of to stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help="compare two result files instead of running anything")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='pancake-bench-') as tmp:
+        make_tree(tmp, args.files, args.matchers, args.depth)
+        os.chdir(tmp)
+        try:
+            summary = run_benchmarks(args)
+        finally:
+            os.chdir(cwd)
+
+    data = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': {'files': args.files, 'matchers': args.matchers, 'depth': args.depth,
+            'repeat': args.repeat, 'jobs': args.jobs},
+        **summary,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
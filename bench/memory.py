@@ -0,0 +1,91 @@
+"""measure how much memory pancake's rules take up.
+
+builds a synthetic graph in memory the way a makefile would, through the
+same decorators: every source gets a file rule (like the texture exports),
+every output gets a copy rule (like the mods' aliases), and they all fan
+into a pair of phony rules. then reports what tracemalloc saw.
+
+    python bench/memory.py [--rules N] [-o results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pancake
+
+def build_graph(rules):
+    makefile = pancake.Makefile()
+    rule = lambda *targets: pancake.rule(makefile, *targets)
+    deps = lambda *deps: pancake.deps(makefile, *deps)
+
+    @rule()
+    def export():
+        pass
+
+    @rule()
+    @deps('export')
+    def copy():
+        pass
+
+    for i in range(rules // 2):
+        src = f'assets/mod{i % 20}/textures/blocks/group{i % 97}/texture_{i}.ase'
+        dst = f'build/assets/mod{i % 20}/textures/blocks/group{i % 97}/texture_{i}.png'
+
+        @export.depends_on
+        @rule(dst, dst + '.mcmeta')
+        @deps(src)
+        def export_rule(targets, deps):
+            pass
+
+        # built again from scratch, the way str(BUILD_DIR/src) would be
+        @copy.depends_on
+        @rule(f'build/assets/alias{i % 7}/textures/blocks/texture_{i}.png')
+        @deps(f'build/assets/mod{i % 20}/textures/blocks/group{i % 97}/texture_{i}.png')
+        def copy_rule(target, dep):
+            pass
+
+    return makefile
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, default=100000,
+        help="number of file rules (default: %(default)s)")
+    parser.add_argument('-o', '--output',
+        help="write the results here as json instead of to stdout")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    makefile = build_graph(args.rules)
+    rules_size, rules_peak = tracemalloc.get_traced_memory()
+    # there are no files behind the sources here, so the graph just records
+    # them as missing
+    graph = makefile.graph()
+    graph_size, graph_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = len(set(makefile.rules.values()))
+    data = {
+        'rules': count,
+        'rules_bytes': rules_size,
+        'bytes_per_rule': rules_size / count,
+        'graph_bytes': graph_size - rules_size,
+        'peak_bytes': max(rules_peak, graph_peak),
+    }
+    print(f"{count} rules: {rules_size / 2**20:.1f} MiB ({rules_size / count:.0f} bytes per rule), "
+        f"graph {(graph_size - rules_size) / 2**20:.1f} MiB, peak {data['peak_bytes'] / 2**20:.1f} MiB",
+        file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""check that starting pancake stays cheap.
+
+runs each startup case a few times in a fresh interpreter and fails if the
+median wall time goes over its budget, or if any module that should only be
+imported on demand got imported anyway.
+
+    python bench/startup.py [--runs N] [--scale X]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that only rules or particular commands should ever need
+LAZY_MODULES = ['mistune', 'numpy', 'png', 'progressbar', 'watchdog']
+
+# (name, arguments to python, budget in seconds)
+CASES = [
+    ('list-rules', ['pancake.py', 'list-rules'], 0.3),
+    ('load', ['-c', "import pancake; pancake.Makefile().load('Makefile.py')"], 0.5),
+]
+
+def run(args):
+    """run python with `args` and return its wall time & the top level modules it imported."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', *args],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        sys.exit(proc.stderr)
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip().split('.')[0])
+    return elapsed, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+        help="runs per case (default: %(default)s)")
+    parser.add_argument('--scale', type=float, default=1.0,
+        help="multiply every budget by this, for slow machines (default: %(default)s)")
+    args = parser.parse_args()
+
+    failed = False
+    for name, case, budget in CASES:
+        # the first run warms the rule cache & the os's file cache
+        run(case)
+        times = []
+        imported = set()
+        for _ in range(args.runs):
+            elapsed, modules = run(case)
+            times.append(elapsed)
+            imported |= modules
+        median = statistics.median(times)
+        budget *= args.scale
+        eager = sorted(imported.intersection(LAZY_MODULES))
+
+        status = 'ok'
+        if median > budget or eager:
+            status = 'FAIL'
+            failed = True
+        print(f"{name:<12} {median * 1000:7.1f} ms  (budget {budget * 1000:.0f} ms)  {status}")
+        if eager:
+            print(f"{'':<12} imported eagerly: {', '.join(eager)}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+import io
+import numpy
+import os.path
+import png
+import struct
+import zlib
+
+from metapack.staging import write_if_changed
+
+class AsepriteError(ValueError):
+    pass
+
+class UnsupportedSprite(AsepriteError):
+    """the sprite uses a feature we can't render. aseprite itself can still export it."""
+    pass
+
+HEADER_MAGIC = 0xA5E0
+FRAME_MAGIC = 0xF1FA
+
+OLD_PALETTE_CHUNK = 0x0004
+OLD_PALETTE_6BIT_CHUNK = 0x0011
+LAYER_CHUNK = 0x2004
+CEL_CHUNK = 0x2005
+TAGS_CHUNK = 0x2018
+PALETTE_CHUNK = 0x2019
+USER_DATA_CHUNK = 0x2020
+SLICE_CHUNK = 0x2022
+
+LAYER_VISIBLE = 1
+LAYER_BACKGROUND = 8
+LAYER_REFERENCE = 64
+
+RAW_CEL = 0
+LINKED_CEL = 1
+COMPRESSED_CEL = 2
+
+BLEND_MODES = [
+    'normal', 'multiply', 'screen', 'overlay', 'darken', 'lighten',
+    'color_dodge', 'color_burn', 'hard_light', 'soft_light', 'difference',
+    'exclusion', 'hue', 'saturation', 'color', 'luminosity', 'addition',
+    'subtract', 'divide']
+
+TAG_DIRECTIONS = ['forward', 'reverse', 'pingpong', 'pingpong_reverse']
+
+class _Reader(object):
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt):
+        fmt = '<' + fmt
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def bytes(self, n):
+        res = self.data[self.offset:self.offset + n]
+        self.offset += n
+        return res
+
+    def string(self):
+        n, = self.unpack('H')
+        return self.bytes(n).decode('utf-8')
+
+class Layer(object):
+    def __init__(self, flags, kind, child_level, blend_mode, opacity, name):
+        self.flags = flags
+        self.kind = kind
+        self.child_level = child_level
+        self.blend_mode = blend_mode
+        self.opacity = opacity
+        self.name = name
+        self.parent = None
+        self.data = None
+        self.color = None
+
+    @property
+    def visible(self):
+        if self.flags & LAYER_REFERENCE or not self.flags & LAYER_VISIBLE:
+            return False
+        return self.parent is None or self.parent.visible
+
+class Cel(object):
+    def __init__(self, layer, x, y, opacity, z_index):
+        self.layer = layer
+        self.x = x
+        self.y = y
+        self.opacity = opacity
+        self.z_index = z_index
+        self.image = None
+        self.data = None
+        self.color = None
+
+class Frame(object):
+    def __init__(self, duration):
+        self.duration = duration
+        self.cels = []
+
+class Tag(object):
+    def __init__(self, name, start, end, direction):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.direction = direction
+        self.data = None
+        self.color = None
+
+class Slice(object):
+    def __init__(self, name, keys):
+        self.name = name
+        self.keys = keys
+        self.data = None
+        self.color = None
+
+class Sprite(object):
+    def __init__(self, width, height, depth, flags, transparent_index):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.flags = flags
+        self.transparent_index = transparent_index
+        self.layers = []
+        self.frames = []
+        self.palette = numpy.zeros((0, 4), numpy.uint8)
+        self.tags = []
+        self.slices = []
+        self.data = None
+        self.color = None
+
+    @property
+    def channels(self):
+        return {32: 4, 16: 2, 8: 1}[self.depth]
+
+    def render(self, index):
+        """flatten the visible layers of a frame into one image.
+
+        indexed sprites are rendered to an array of palette indices, like aseprite does. everything else is rendered to an RGBA array."""
+        cels = sorted(self.frames[index].cels,
+            key=lambda cel: (cel.layer + cel.z_index, cel.z_index))
+        if self.depth == 8:
+            canvas = numpy.full((self.height, self.width), self.transparent_index, numpy.uint8)
+        else:
+            canvas = numpy.zeros((self.height, self.width, 4), numpy.int32)
+
+        for cel in cels:
+            layer = self.layers[cel.layer]
+            if not layer.visible or cel.image is None:
+                continue
+            src, dst = _clip(cel, self.width, self.height)
+            if src is None:
+                continue
+            image = cel.image[src]
+            if self.depth == 8:
+                # indexed sprites ignore blend modes & opacity entirely
+                if layer.flags & LAYER_BACKGROUND:
+                    canvas[dst] = image
+                else:
+                    mask = image != self.transparent_index
+                    canvas[dst][mask] = image[mask]
+            else:
+                if self.depth == 16:
+                    image = image[..., [0, 0, 0, 1]]
+                opacity = cel.opacity
+                if self.flags & 1:
+                    opacity = _mul_un8(opacity, layer.opacity)
+                canvas[dst] = _blend(layer.blend_mode,
+                    canvas[dst], image.astype(numpy.int32), opacity)
+
+        if self.depth == 8:
+            return canvas
+        else:
+            return canvas.astype(numpy.uint8)
+
+    def sheet(self):
+        """render every frame and stack them in a single column."""
+        return numpy.concatenate([self.render(i) for i in range(len(self.frames))])
+
+    def write_sheet(self, filename):
+        sheet = self.sheet()
+        h, w = sheet.shape[:2]
+        f = io.BytesIO()
+        if self.depth == 8:
+            writer = png.Writer(w, h, palette=self._png_palette(sheet.max()))
+            writer.write(f, sheet)
+        elif self.depth == 16:
+            writer = png.Writer(w, h, greyscale=True, alpha=True)
+            writer.write(f, sheet[..., [0, 3]].reshape(h, w * 2))
+        else:
+            writer = png.Writer(w, h, greyscale=False, alpha=True)
+            writer.write(f, sheet.reshape(h, w * 4))
+        write_if_changed(filename, f.getvalue())
+
+    def _png_palette(self, max_index):
+        palette = [tuple(map(int, color)) for color in self.palette]
+        while len(palette) <= max_index:
+            palette.append((0, 0, 0, 255))
+        if not any(layer.flags & LAYER_BACKGROUND and layer.visible for layer in self.layers):
+            if self.transparent_index < len(palette):
+                r, g, b, a = palette[self.transparent_index]
+                palette[self.transparent_index] = (r, g, b, 0)
+        return palette[:256]
+
+    def sheet_data(self, image, name='sprite'):
+        """describe a column sheet the way `aseprite --sheet-type columns --format json-array --list-tags --list-layers --list-slices` does."""
+        w, h = self.width, self.height
+        frames = []
+        for i, frame in enumerate(self.frames):
+            frames.append({
+                'filename': f'{name} {i}.ase' if len(self.frames) > 1 else f'{name}.ase',
+                'frame': {'x': 0, 'y': i * h, 'w': w, 'h': h},
+                'rotated': False,
+                'trimmed': False,
+                'spriteSourceSize': {'x': 0, 'y': 0, 'w': w, 'h': h},
+                'sourceSize': {'w': w, 'h': h},
+                'duration': frame.duration,
+            })
+
+        layers = []
+        for layer in self.layers:
+            info = {'name': layer.name}
+            if layer.parent is not None:
+                info['group'] = layer.parent.name
+            if layer.kind == 0:
+                info['opacity'] = layer.opacity
+                info['blendMode'] = BLEND_MODES[layer.blend_mode]
+            layers.append(_with_user_data(info, layer))
+
+        tags = [_with_user_data({
+            'name': tag.name,
+            'from': tag.start,
+            'to': tag.end,
+            'direction': TAG_DIRECTIONS[tag.direction],
+        }, tag) for tag in self.tags]
+
+        slices = [_with_user_data({
+            'name': s.name,
+            'keys': s.keys,
+        }, s) for s in self.slices]
+
+        return {
+            'frames': frames,
+            'meta': {
+                'app': 'metapack.aseprite',
+                'image': str(image),
+                'format': 'I8' if self.depth == 8 else 'RGBA8888',
+                'size': {'w': w, 'h': h * len(self.frames)},
+                'scale': '1',
+                'frameTags': tags,
+                'layers': layers,
+                'slices': slices,
+            },
+        }
+
+def _with_user_data(info, obj):
+    if obj.color is not None:
+        info['color'] = '#{:02x}{:02x}{:02x}{:02x}'.format(*obj.color)
+    if obj.data is not None:
+        info['data'] = obj.data
+    return info
+
+def _clip(cel, width, height):
+    h, w = cel.image.shape[:2]
+    x0, y0 = max(cel.x, 0), max(cel.y, 0)
+    x1, y1 = min(cel.x + w, width), min(cel.y + h, height)
+    if x0 >= x1 or y0 >= y1:
+        return None, None
+    src = (slice(y0 - cel.y, y1 - cel.y), slice(x0 - cel.x, x1 - cel.x))
+    dst = (slice(y0, y1), slice(x0, x1))
+    return src, dst
+
+def _mul_un8(a, b):
+    # aseprite's fixed point multiply for 8 bit channels
+    t = a * b + 0x80
+    return ((t >> 8) + t) >> 8
+
+def _div(a, b):
+    # C style integer division, rounding towards zero
+    return numpy.sign(a) * (numpy.abs(a) // b)
+
+_BLEND_FUNCS = {
+    'multiply': lambda b, s: _mul_un8(b, s),
+    'screen': lambda b, s: b + s - _mul_un8(b, s),
+    'darken': numpy.minimum,
+    'lighten': numpy.maximum,
+    'difference': lambda b, s: numpy.abs(b - s),
+    'addition': lambda b, s: numpy.minimum(b + s, 255),
+    'subtract': lambda b, s: numpy.maximum(b - s, 0),
+}
+
+def _blend(mode, back, src, opacity):
+    name = BLEND_MODES[mode] if mode < len(BLEND_MODES) else str(mode)
+    if name != 'normal':
+        if name not in _BLEND_FUNCS:
+            raise UnsupportedSprite(f"can't render {name} blend mode")
+        src = src.copy()
+        src[..., :3] = _BLEND_FUNCS[name](back[..., :3], src[..., :3])
+    return _blend_normal(back, src, opacity)
+
+def _blend_normal(back, src, opacity):
+    ba = back[..., 3:]
+    sa = _mul_un8(src[..., 3:], opacity)
+    ra = sa + ba - _mul_un8(ba, sa)
+    rgb = back[..., :3] + _div((src[..., :3] - back[..., :3]) * sa, numpy.maximum(ra, 1))
+    res = numpy.concatenate([rgb, ra], axis=-1)
+    res = numpy.where(src[..., 3:] == 0, back, res)
+    return numpy.where(ba == 0, numpy.concatenate([src[..., :3], sa], axis=-1), res)
+
+def _read_pixels(sprite, data, w, h):
+    pixels = numpy.frombuffer(data, numpy.uint8, w * h * sprite.channels)
+    if sprite.channels == 1:
+        return pixels.reshape(h, w)
+    else:
+        return pixels.reshape(h, w, sprite.channels)
+
+def _read_cel(r, end, sprite, frames):
+    layer, x, y, opacity, kind, z_index = r.unpack('HhhBHh')
+    r.bytes(5)
+    cel = Cel(layer, x, y, opacity, z_index)
+    if kind == RAW_CEL:
+        w, h = r.unpack('HH')
+        cel.image = _read_pixels(sprite, r.bytes(end - r.offset), w, h)
+    elif kind == LINKED_CEL:
+        link, = r.unpack('H')
+        for other in frames[link].cels:
+            if other.layer == layer:
+                cel.image = other.image
+                break
+    elif kind == COMPRESSED_CEL:
+        w, h = r.unpack('HH')
+        cel.image = _read_pixels(sprite, zlib.decompress(r.bytes(end - r.offset)), w, h)
+    else:
+        raise UnsupportedSprite("can't render tilemap cels")
+    return cel
+
+def _read_layer(r, sprite):
+    flags, kind, child_level, _, _, blend_mode, opacity = r.unpack('HHHHHHB')
+    r.bytes(3)
+    layer = Layer(flags, kind, child_level, blend_mode, opacity, r.string())
+    if kind == 2:
+        raise UnsupportedSprite("can't render tilemap layers")
+    for parent in reversed(sprite.layers):
+        if parent.child_level < child_level:
+            layer.parent = parent
+            break
+    return layer
+
+def _read_palette(r, sprite):
+    size, first, last = r.unpack('III')
+    r.bytes(8)
+    if len(sprite.palette) != size:
+        palette = numpy.zeros((size, 4), numpy.uint8)
+        n = min(size, len(sprite.palette))
+        palette[:n] = sprite.palette[:n]
+        sprite.palette = palette
+    for idx in range(first, last + 1):
+        flags, red, green, blue, alpha = r.unpack('HBBBB')
+        if flags & 1:
+            r.string()
+        sprite.palette[idx] = (red, green, blue, alpha)
+
+def _read_old_palette(r, sprite, scale):
+    palette = list(map(tuple, sprite.palette))
+    idx = 0
+    npackets, = r.unpack('H')
+    for _ in range(npackets):
+        skip, ncolors = r.unpack('BB')
+        idx += skip
+        for _ in range(ncolors or 256):
+            red, green, blue = r.unpack('BBB')
+            while len(palette) <= idx:
+                palette.append((0, 0, 0, 255))
+            palette[idx] = (red * scale, green * scale, blue * scale, 255)
+            idx += 1
+    sprite.palette = numpy.uint8(palette).reshape(-1, 4)
+
+def _read_tags(r):
+    ntags, = r.unpack('H')
+    r.bytes(8)
+    tags = []
+    for _ in range(ntags):
+        start, end, direction, repeat = r.unpack('HHBH')
+        r.bytes(10)
+        tags.append(Tag(r.string(), start, end, direction))
+    return tags
+
+def _read_slice(r):
+    nkeys, flags, _ = r.unpack('III')
+    name = r.string()
+    keys = []
+    for _ in range(nkeys):
+        frame, x, y, w, h = r.unpack('IiiII')
+        key = {'frame': frame, 'bounds': {'x': x, 'y': y, 'w': w, 'h': h}}
+        if flags & 1:
+            x, y, w, h = r.unpack('iiII')
+            key['center'] = {'x': x, 'y': y, 'w': w, 'h': h}
+        if flags & 2:
+            x, y = r.unpack('ii')
+            key['pivot'] = {'x': x, 'y': y}
+        keys.append(key)
+    return Slice(name, keys)
+
+def _read_user_data(r, target):
+    flags, = r.unpack('I')
+    if flags & 1:
+        target.data = r.string()
+    if flags & 2:
+        target.color = r.unpack('BBBB')
+
+def parse(data):
+    r = _Reader(data)
+    _, magic, nframes, width, height, depth, flags = r.unpack('IHHHHHI')
+    if magic != HEADER_MAGIC:
+        raise AsepriteError("not an aseprite file")
+    if depth not in (8, 16, 32):
+        raise AsepriteError(f"unknown color depth {depth}")
+    r.unpack('HII')
+    transparent_index, = r.unpack('B')
+    sprite = Sprite(width, height, depth, flags, transparent_index)
+
+    offset = 128
+    has_new_palette = False
+    for _ in range(nframes):
+        r.offset = offset
+        size, magic, old_nchunks, duration, _, nchunks = r.unpack('IHHHHI')
+        if magic != FRAME_MAGIC:
+            raise AsepriteError("corrupt frame header")
+        frame = Frame(duration)
+        # user data chunks describe whatever came right before them
+        user_data_targets = [sprite]
+        for _ in range(nchunks or old_nchunks):
+            start = r.offset
+            chunk_size, kind = r.unpack('IH')
+            end = start + chunk_size
+            if kind == LAYER_CHUNK:
+                layer = _read_layer(r, sprite)
+                sprite.layers.append(layer)
+                user_data_targets = [layer]
+            elif kind == CEL_CHUNK:
+                cel = _read_cel(r, end, sprite, sprite.frames)
+                frame.cels.append(cel)
+                user_data_targets = [cel]
+            elif kind == PALETTE_CHUNK:
+                _read_palette(r, sprite)
+                has_new_palette = True
+                user_data_targets = [sprite]
+            elif kind in (OLD_PALETTE_CHUNK, OLD_PALETTE_6BIT_CHUNK):
+                if not has_new_palette:
+                    _read_old_palette(r, sprite, 4 if kind == OLD_PALETTE_6BIT_CHUNK else 1)
+            elif kind == TAGS_CHUNK:
+                sprite.tags.extend(_read_tags(r))
+                user_data_targets = list(sprite.tags)
+            elif kind == SLICE_CHUNK:
+                s = _read_slice(r)
+                sprite.slices.append(s)
+                user_data_targets = [s]
+            elif kind == USER_DATA_CHUNK:
+                if user_data_targets:
+                    _read_user_data(r, user_data_targets.pop(0))
+            r.offset = end
+        sprite.frames.append(frame)
+        offset += size
+
+    return sprite
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return parse(f.read())
+
+def export_sheet(src, sheet):
+    """render an .ase file into a column sheet png.
+
+    returns the same data `aseprite -b src --sheet sheet --sheet-type columns --format json-array` would print."""
+    sprite = read(src)
+    sprite.write_sheet(sheet)
+    return sprite.sheet_data(sheet, os.path.splitext(os.path.basename(src))[0])
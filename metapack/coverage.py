@@ -0,0 +1,90 @@
+import os
+import os.path
+
+from collections import namedtuple
+
+# a texture counts as done if there's a sprite to export or a png to copy
+TEXTURE_EXTENSIONS = ('.png', '.ase')
+
+class Coverage(namedtuple('Coverage', 'name total done missing')):
+    """how many of a checklist's (or a directory's) entries are done, and which aren't."""
+    @property
+    def percent(self):
+        return 100 * self.done / self.total if self.total else 100.0
+
+def index_tree(root):
+    """walk a directory tree once and return the paths in it without their extensions, in a set per extension."""
+    index = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirpath = dirpath.replace(os.sep, '/')
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            index.setdefault(ext, set()).add(f'{dirpath}/{stem}')
+    return index
+
+def add_aliases(index, aliases, extensions=TEXTURE_EXTENSIONS):
+    """add (source, alias) pairs to the index, e.g. the mods' aliases, but only those whose source is in it."""
+    for src, dst in aliases:
+        src_stem, src_ext = os.path.splitext(src)
+        if any(src_stem in index.get(ext, ()) for ext in extensions):
+            stem, ext = os.path.splitext(dst)
+            index.setdefault(ext, set()).add(stem)
+
+def read_checklists(directory):
+    """return {name: [entry, ...]} for every checklist in a directory, named after its file."""
+    checklists = {}
+    for name in sorted(os.listdir(directory)):
+        base, ext = os.path.splitext(name)
+        if ext == '.txt':
+            with open(os.path.join(directory, name)) as f:
+                checklists[base] = [line for line in map(str.strip, f) if line]
+    return checklists
+
+def coverage(checklists, index, extensions=TEXTURE_EXTENSIONS):
+    """resolve every checklist against an index from `index_tree`.
+
+    returns {name: (Coverage, [Coverage per directory, ...])}."""
+    done = set().union(*(index.get(ext, ()) for ext in extensions))
+    results = {}
+    for name, entries in checklists.items():
+        stems = {os.path.splitext(entry)[0]: entry for entry in entries}
+        missing = stems.keys() - done
+        dirs = {}
+        for stem, entry in stems.items():
+            counts = dirs.setdefault(os.path.dirname(stem), [0, []])
+            counts[0] += 1
+            if stem in missing:
+                counts[1].append(entry)
+        results[name] = (
+            Coverage(name, len(stems), len(stems) - len(missing), sorted(stems[stem] for stem in missing)),
+            [Coverage(dirname, total, total - len(left), sorted(left))
+                for dirname, (total, left) in sorted(dirs.items())])
+    return results
+
+def report(results):
+    """yield a line for each checklist & each of its directories with how much of it is done."""
+    width = max((len(mod.name) for mod, dirs in results.values()), default=5)
+    width = max([width, *(len(c.name) + 2 for mod, dirs in results.values() for c in dirs)])
+    for mod, dirs in results.values():
+        yield _report_line(mod, width)
+        for c in dirs:
+            yield _report_line(c, width, '  ')
+    total = sum(mod.total for mod, dirs in results.values())
+    done = sum(mod.done for mod, dirs in results.values())
+    yield _report_line(Coverage('total', total, done, []), width)
+
+def _report_line(c, width, indent=''):
+    return f"{indent + c.name:<{width}}  {c.done:>6}/{c.total:<6}  {c.percent:>6.1f}%"
+
+def to_json(results):
+    return {
+        name: {
+            'total': mod.total,
+            'done': mod.done,
+            'percent': mod.percent,
+            'missing': mod.missing,
+            'directories': {c.name: {'total': c.total, 'done': c.done, 'percent': c.percent}
+                for c in dirs},
+        }
+        for name, (mod, dirs) in results.items()
+    }
@@ -1,42 +1,75 @@
+import io
 import json
 import numpy
 import os
 import png
+import threading
 
-from array import array
+from collections import OrderedDict, namedtuple
 from pathlib import Path
-from random import choice, randrange
+from random import Random
+
+from metapack.staging import write_if_changed
+
+# how many decoded tiles to keep around
+TILE_CACHE_SIZE = 512
+
+Tile = namedtuple('Tile', 'indices palette')
+
+_tile_cache = OrderedDict()
+_tile_cache_lock = threading.Lock()
 
 def isindexed(info):
-    return info['bitdepth'] == 8 and info['planes'] == 1 and 'palette' in info
+    return info['planes'] == 1 and 'palette' in info
 
-def chunked(iterable, chunk_size):
-    return zip(*([iter(iterable)] * chunk_size))
+def _rgba(color):
+    if len(color) == 4:
+        return tuple(color)
+    else:
+        return (*color, 255)
 
-def palette_from_pixels(data, info):
-    planes = info['planes']
-    return set(color for row in data for color in chunked(row, info['planes']))
+def index_pixels(pixels):
+    """turn an array of RGBA pixels into an array of palette indices plus the palette."""
+    h, w = pixels.shape[:2]
+    packed = numpy.ascontiguousarray(pixels, numpy.uint8).view(numpy.uint32).reshape(h, w)
+    colors, indices = numpy.unique(packed, return_inverse=True)
+    palette = [tuple(map(int, color)) for color in colors.view(numpy.uint8).reshape(-1, 4)]
+    dtype = numpy.uint8 if len(palette) <= 256 else numpy.uint16
+    return indices.reshape(h, w).astype(dtype), palette
 
-def load_palette(filename):
+def decode_tile(filename):
     with open(filename, 'rb') as file:
         reader = png.Reader(file)
         w, h, data, info = reader.read()
         if isindexed(info):
-            return info['palette']
+            indices = numpy.vstack(list(map(numpy.uint8, data)))
+            return Tile(indices, list(map(_rgba, info['palette'])))
         else:
-            return list(palette_from_pixels(data, info))
+            w, h, data, info = reader.asRGBA8()
+            pixels = numpy.vstack(list(map(numpy.uint8, data))).reshape(h, w, 4)
+            return Tile(*index_pixels(pixels))
 
-def load_tile(filename):
-    with open(filename, 'rb') as file:
-        reader = png.Reader(file)
-        w, h, data, info = reader.read()
-        if isindexed(info):
-            return numpy.vstack(map(numpy.uint8, data))
-        else:
-            data = list(data)
-            palette = {color:idx for idx, color in enumerate(palette_from_pixels(data, info))}
-            return numpy.vstack(numpy.uint8([palette[color] for color in chunked(row, info['planes'])]) for row in data)
+def load(filename):
+    """return a decoded tile, reusing the last decode if the file hasn't changed since."""
+    key = (os.fspath(filename), os.stat(filename).st_mtime_ns)
+    with _tile_cache_lock:
+        if key in _tile_cache:
+            _tile_cache.move_to_end(key)
+            return _tile_cache[key]
+    tile = decode_tile(filename)
+    # tiles are shared between callers, so nobody gets to scribble on them
+    tile.indices.setflags(write=False)
+    with _tile_cache_lock:
+        _tile_cache[key] = tile
+        while len(_tile_cache) > TILE_CACHE_SIZE:
+            _tile_cache.popitem(last=False)
+    return tile
 
+def load_palette(filename):
+    return load(filename).palette
+
+def load_tile(filename):
+    return load(filename).indices
 
 def blit(dst, dx, dy, src, sx, sy, w, h):
     dst[dy:dy+h, dx:dx+w] = src[sy:sy+h, sx:sx+w]
@@ -44,36 +77,72 @@ def blit(dst, dx, dy, src, sx, sy, w, h):
 def isopaque(color):
     return color[3] != 0
 
-def glitch(filename, tile_list):
-    nframes = randrange(1, 5)
-    bedrock = numpy.ndarray((16 * nframes, 16), numpy.uint8)
-    frames = []
-    for idx in range(nframes):
-        frames.append({
-            'index': idx,
-            'time':randrange(16, 64)
-        })
-        y0 = idx * 16
-        for dx, dy in ((0,0), (0,8), (8,0), (8,8)):
-            tile = load_tile(choice(tile_list))
-            sx = randrange(0, tile.shape[1], 8)
-            sy = randrange(0, tile.shape[0], 8)
-            blit(bedrock, dx, y0 + dy, tile, sx, sy, 8, 8)
-
-    maxcolor = bedrock.max()
-    palette = []
-    while len(palette) <= maxcolor:
-        palette.extend(filter(isopaque, load_palette(choice(tile_list))))
-    if len(palette) > 255:
-        del palette[256:]
-
-    with open(filename, 'wb') as file:
+def cut_blocks(tiles, size=8):
+    """cut every tile into size×size blocks.
+
+    returns one array holding every block, plus the index of each tile's first block & how many blocks it has."""
+    blocks, first, count = [], [], []
+    n = 0
+    for tile in tiles:
+        h, w = tile.indices.shape
+        hb, wb = h // size, w // size
+        cut = tile.indices[:hb*size, :wb*size] \
+            .reshape(hb, size, wb, size) \
+            .transpose(0, 2, 1, 3) \
+            .reshape(-1, size, size)
+        blocks.append(cut)
+        first.append(n)
+        count.append(len(cut))
+        n += len(cut)
+    return numpy.concatenate(blocks), first, count
+
+def glitch_all(filenames, tile_list, seed=None):
+    """generate a glitched, animated texture at each filename.
+
+    every frame is stitched together from 8×8 blocks of random tiles and gets the palette of other random tiles. the same seed & tile pool always produce the same textures."""
+    rng = Random(seed)
+    tiles = [load(filename) for filename in sorted(map(str, tile_list))]
+    tiles = [tile for tile in tiles if min(tile.indices.shape) >= 8]
+    blocks, first, count = cut_blocks(tiles)
+
+    variants = []
+    picks = []
+    for filename in filenames:
+        nframes = rng.randrange(1, 5)
+        times = [rng.randrange(16, 64) for _ in range(nframes)]
+        for _ in range(nframes * 4):
+            t = rng.randrange(len(tiles))
+            picks.append(first[t] + rng.randrange(count[t]))
+        variants.append((filename, nframes, times))
+
+    # grab every block of every frame of every texture in one go
+    picked = blocks[picks].astype(numpy.uint8)
+    offset = 0
+    for filename, nframes, times in variants:
+        quads = picked[offset:offset + nframes * 4]
+        offset += nframes * 4
+        # blocks go top left, bottom left, top right, bottom right
+        bedrock = quads.reshape(nframes, 2, 2, 8, 8) \
+            .transpose(0, 2, 3, 1, 4) \
+            .reshape(nframes * 16, 16)
+
+        maxcolor = bedrock.max()
+        palette = []
+        while len(palette) <= maxcolor:
+            palette.extend(filter(isopaque, rng.choice(tiles).palette))
+        if len(palette) > 255:
+            del palette[256:]
+
+        file = io.BytesIO()
         h, w = bedrock.shape
         writer = png.Writer(w, h, palette=palette)
         writer.write(file, bedrock)
-    with open(Path(filename).with_suffix('.png.mcmeta'), 'w') as file:
-        json.dump({
+        write_if_changed(filename, file.getvalue())
+        write_if_changed(Path(filename).with_suffix('.png.mcmeta'), json.dumps({
             'animation': {
-                'frames': frames
+                'frames': [{'index': i, 'time': time} for i, time in enumerate(times)]
             }
-        }, file)
+        }))
+
+def glitch(filename, tile_list, seed=None):
+    glitch_all([filename], tile_list, seed)
@@ -0,0 +1,260 @@
+import json
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+
+LOCAL_MAGIC = 0x04034b50
+CENTRAL_MAGIC = 0x02014b50
+END_MAGIC = 0x06054b50
+
+VERSION = 20
+UTF8_FLAG = 0x800
+DEFLATE_FLAGS = 0x6
+
+STORED = zipfile.ZIP_STORED
+DEFLATED = zipfile.ZIP_DEFLATED
+
+# deflate, but only keep the result if it's actually smaller
+AUTO = 'auto'
+AUTO_LEVEL = 9
+
+# how to compress each kind of file: None to store it, a deflate level, or
+# AUTO. pngs are compressed already, so deflating them rarely helps
+DEFAULT_POLICY = {
+    '.png': AUTO,
+    '.json': 9,
+    '.mcmeta': 9,
+    '.lang': 9,
+}
+
+class Entry(namedtuple('Entry', 'name method flags date_time crc compress_size file_size external_attr data')):
+    """a member of the archive, with its data already compressed."""
+    pass
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+def _deflate_flags(level):
+    # the general purpose flags record roughly how hard deflate tried
+    if level >= 8:
+        return 0x2
+    elif level <= 2:
+        return 0x4
+    else:
+        return 0
+
+def compression_for(name, policy):
+    if name.endswith('/'):
+        return None
+    return policy.get(os.path.splitext(name)[1].lower(), AUTO)
+
+def encodings(compression):
+    """return every (method, flags) pair a member could be encoded as under a compression setting."""
+    if compression is None:
+        return {(STORED, 0)}
+    elif compression == AUTO:
+        return {(STORED, 0), (DEFLATED, _deflate_flags(AUTO_LEVEL))}
+    else:
+        return {(DEFLATED, _deflate_flags(compression))}
+
+def encode(data, compression):
+    """compress data according to a compression setting and return (method, flags, compressed data)."""
+    if compression is None:
+        return STORED, 0, data
+    level = AUTO_LEVEL if compression == AUTO else compression
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = c.compress(data) + c.flush()
+    if compression == AUTO and len(deflated) >= len(data):
+        return STORED, 0, data
+    else:
+        return DEFLATED, _deflate_flags(level), deflated
+
+def read_source(source):
+    """return the content & modification time of an entry's source.
+
+    a source can be a filename, bytes, or None for a directory."""
+    if source is None:
+        return b'', time.localtime()[:6]
+    elif isinstance(source, bytes):
+        return source, time.localtime()[:6]
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+        return data, time.localtime(os.stat(source).st_mtime)[:6]
+
+def read_entries(filename):
+    """read the members of an existing archive, keeping their data compressed."""
+    entries = {}
+    try:
+        z = zipfile.ZipFile(filename)
+    except (OSError, zipfile.BadZipFile):
+        return entries
+    with z, open(filename, 'rb') as f:
+        for info in z.infolist():
+            f.seek(info.header_offset)
+            header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+            if header[0] != LOCAL_MAGIC:
+                continue
+            f.seek(header[-2] + header[-1], os.SEEK_CUR)
+            entries[info.filename] = Entry(info.filename, info.compress_type,
+                info.flag_bits & DEFLATE_FLAGS, info.date_time, info.CRC, info.compress_size, info.file_size,
+                info.external_attr, f.read(info.compress_size))
+    return entries
+
+def make_entry(name, source, compression=None, previous=None):
+    """build an archive entry from a source.
+
+    if `previous` holds the same content compressed the same way, it's returned as is."""
+    if source is None:
+        external_attr = (0o40775 << 16) | 0x10
+    else:
+        external_attr = 0o100664 << 16
+
+    data, date_time = read_source(source)
+    crc = zlib.crc32(data)
+    if previous is not None \
+        and (previous.method, previous.flags) in encodings(compression) \
+        and previous.crc == crc \
+        and previous.file_size == len(data):
+        return previous
+
+    method, flags, compressed = encode(data, compression)
+    return Entry(name, method, flags, date_time, crc, len(compressed),
+        len(data), external_attr, compressed)
+
+def write_entries(filename, entries):
+    """write already compressed entries to a new archive, replacing it atomically."""
+    tmp = f'{filename}.tmp'
+    central = []
+    with open(tmp, 'wb') as f:
+        for entry in entries:
+            name = entry.name.encode('utf-8')
+            flags = entry.flags if entry.name.isascii() else entry.flags | UTF8_FLAG
+            date, tm = _dos_date_time(entry.date_time)
+            offset = f.tell()
+            f.write(LOCAL_HEADER.pack(LOCAL_MAGIC, VERSION, flags, entry.method,
+                tm, date, entry.crc, entry.compress_size, entry.file_size,
+                len(name), 0))
+            f.write(name)
+            f.write(entry.data)
+            central.append(CENTRAL_HEADER.pack(CENTRAL_MAGIC, 3 << 8 | VERSION,
+                VERSION, flags, entry.method, tm, date, entry.crc,
+                entry.compress_size, entry.file_size, len(name), 0, 0, 0, 0,
+                entry.external_attr, offset) + name)
+
+        start = f.tell()
+        for header in central:
+            f.write(header)
+        size = f.tell() - start
+        if len(central) > 0xffff or start > 0xffffffff:
+            raise ValueError("archive is too big without zip64")
+        f.write(END_RECORD.pack(END_MAGIC, 0, 0, len(central), len(central),
+            size, start, 0))
+    os.replace(tmp, filename)
+
+Stats = namedtuple('Stats', 'reused written dropped entries')
+
+def _file_stat(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def read_index(filename):
+    if filename is None:
+        return {}
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_index(filename, index):
+    tmp = f'{filename}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, filename)
+
+def update_zip(filename, sources, policy=DEFAULT_POLICY, incremental=True, jobs=None, index=None):
+    """write a zip archive from a list of (name, source) pairs.
+
+    members are compressed according to `policy` (see DEFAULT_POLICY) on a pool of `jobs` threads, but always end up in the archive in the order they were listed.
+
+    in incremental mode, members of the existing archive whose content hasn't changed are copied over byte for byte instead of being compressed again, and members that aren't listed any more are dropped.
+
+    a file listed under several names (say, a texture and its aliases) is only read & compressed once; the other names get a copy of the same compressed bytes.
+
+    if `index` names a file, the modification time & size of every source file is kept there, and a member whose file hasn't been touched since the last run is reused without reading it at all."""
+    previous = read_entries(filename) if incremental else {}
+    olds = [previous.pop(name, None) for name, source in sources]
+    stats = read_index(index) if incremental else {}
+    new_stats = {}
+    compressions = [compression_for(name, policy) for name, source in sources]
+
+    firsts = {}
+    for i, ((name, source), compression) in enumerate(zip(sources, compressions)):
+        if isinstance(source, str):
+            firsts.setdefault((source, compression), i)
+
+    def make(i):
+        name, source = sources[i]
+        if isinstance(source, str):
+            if firsts[source, compressions[i]] != i:
+                return None
+            # stat before reading, so a file written while we read it is
+            # read again next time
+            stat = new_stats[name] = [source, *(_file_stat(source) or [])]
+            old = olds[i]
+            if old is not None and stats.get(name) == stat \
+                    and (old.method, old.flags) in encodings(compressions[i]):
+                return old
+        return make_entry(name, source, compressions[i], olds[i])
+
+    with ThreadPoolExecutor(jobs or os.cpu_count()) as pool:
+        entries = list(pool.map(make, range(len(sources))))
+
+    for i, entry in enumerate(entries):
+        if entry is None:
+            name, source = sources[i]
+            entry = entries[firsts[source, compressions[i]]]._replace(name=name)
+            old = olds[i]
+            if old is not None and old[1:] == entry[1:]:
+                entry = old
+            entries[i] = entry
+
+    write_entries(filename, entries)
+    if index is not None:
+        write_index(index, new_stats)
+    reused = sum(entry is old for entry, old in zip(entries, olds))
+    return Stats(reused, len(entries) - reused, len(previous), entries)
+
+def report(entries):
+    """yield a line for each member comparing its stored & compressed size, then the totals."""
+    methods = {STORED: 'stored', DEFLATED: 'deflated'}
+    width = max((len(entry.name) for entry in entries), default=0)
+    file_size = compress_size = 0
+    for entry in entries:
+        if entry.name.endswith('/'):
+            continue
+        file_size += entry.file_size
+        compress_size += entry.compress_size
+        yield _report_line(entry.name, width, methods.get(entry.method, entry.method),
+            entry.file_size, entry.compress_size)
+    yield _report_line('total', width, '', file_size, compress_size)
+
+def _report_line(name, width, method, file_size, compress_size):
+    ratio = compress_size / file_size if file_size else 1
+    return f"{name:<{width}}  {method:<8}  {file_size:>10}  {compress_size:>10}  {ratio:>6.1%}"
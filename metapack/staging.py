@@ -0,0 +1,69 @@
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux's ioctl for sharing a file's extents with another file
+FICLONE = 0x40049409
+
+# 'auto' tries a reflink, then a hard link, then gives up & copies
+MODES = ('auto', 'reflink', 'hardlink', 'copy')
+
+def reflink(src, dst):
+    """make dst a copy-on-write clone of src. raises OSError if the filesystem can't do that."""
+    if fcntl is None:
+        raise OSError("reflinks aren't supported here")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            os.unlink(dst)
+            raise
+
+def stage_file(src, dst, mode='auto'):
+    """put a copy of src at dst as cheaply as possible and return how it was done.
+
+    a hard link shares its content with the source, so whatever was at dst is always removed first; writing to dst later could otherwise write through to the source."""
+    if mode not in MODES:
+        raise ValueError(f"unknown staging mode {mode!r}")
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+
+    if mode in ('auto', 'reflink'):
+        try:
+            reflink(src, dst)
+            return 'reflink'
+        except OSError:
+            pass
+    if mode in ('auto', 'hardlink'):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+def write_if_changed(filename, data):
+    """write data to a file unless the file already holds exactly that, and return whether it was written.
+
+    leaving an identical file alone keeps its modification time, so nothing downstream of it looks out of date. the new content goes to a temporary file that then replaces the old one: writing in place could write through a hard link into a source file (see stage_file)."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    try:
+        if os.path.getsize(filename) == len(data):
+            with open(filename, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+    tmp = f'{filename}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+    return True
@@ -1,42 +1,87 @@
 # -------------------------------
-from fnmatch import fnmatch
+import functools
+import re
+
 from pathlib import Path
 
+def _translate_part(part, hidden):
+    """translate one component of a glob pattern into a regex that matches one path component."""
+    res = []
+    if not hidden and not part.startswith('.') and part != '**':
+        # like glob, wildcards don't match hidden files unless asked to
+        res.append(r'(?!\.)')
+    i, n = 0, len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == '*':
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and part[j] in '!^':
+                j += 1
+            if j < n and part[j] == ']':
+                j += 1
+            while j < n and part[j] != ']':
+                j += 1
+            if j >= n:
+                res.append(r'\[')
+            else:
+                chars = part[i:j].replace('\\', r'\\')
+                i = j + 1
+                if chars[0] in '!^':
+                    chars = '^' + chars[1:]
+                res.append(f'[{chars}]')
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+def translate_glob(pattern, hidden=True):
+    """translate a glob pattern into a regex source string.
+
+    the regex is meant to be matched against a path with a trailing slash, so every component (including the last) ends in one. that makes `**` simply "zero or more components". if `hidden` is false, wildcards won't match names starting with a dot, the way `glob` behaves."""
+    res = []
+    for part in Path(pattern).parts:
+        if part == '**':
+            if hidden:
+                res.append('(?:[^/]*/)*')
+            else:
+                res.append(r'(?:(?!\.)[^/]*/)*')
+        else:
+            res.append(_translate_part(part, hidden) + '/')
+    return ''.join(res)
+
+@functools.lru_cache(maxsize=256)
+def compile_glob(pattern, partial=False, hidden=True):
+    """compile a glob pattern into a regex. see `translate_glob`.
+
+    a partial pattern only has to match the last few components of a path."""
+    if partial:
+        return re.compile(r'(?:^|(?<=/))' + translate_glob(pattern, hidden) + r'\Z')
+    else:
+        return re.compile(r'\A' + translate_glob(pattern, hidden) + r'\Z')
+
 def pathmatch(filename, pattern, partial=False):
     """test if a path matches a glob pattern.
 
     this function substitute for Path.match because Path.match doesn't correctly handle ** in the middle of a pattern (are you serious)."""
-    f = tuple(reversed(Path(filename).parts))
-    p = tuple(reversed(Path(pattern).parts))
-    return _pathmatch(f, p, partial)
-
-def _pathmatch(f, p, partial):
-    if len(p) == 0:
-        return partial or len(f) == 0
-    elif len(f) == 0:
-        return False
-    elif p[0] == '**':
-        p_rest = p[1:]
-        for i in range(len(f)):
-            if _pathmatch(f[i:], p_rest, partial):
-                return True
-        return False
-    elif fnmatch(f[0], p[0]):
-        return _pathmatch(f[1:], p[1:], partial)
-    else:
-        return False
+    filename = Path(filename).as_posix() + '/'
+    return compile_glob(str(pattern), partial).search(filename) is not None
 
 # -------------------------------
 import abc
-import classtools
 import functools
-import glob
 import inspect
-import os.path
+import os
+import re
 import sys
 import time
 import traceback
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 class RuleExecutionError(RuntimeError):
@@ -44,24 +89,56 @@ class RuleExecutionError(RuntimeError):
         self.rule = rule
         self.info = traceback.TracebackException(ex_type, ex_value, stack)
 
+class Cause(namedtuple('Cause', 'kind subject')):
+    """why a rule needs to run. `kind` says what happened and `subject` names the target, dependency or rule it happened to."""
+    messages = {
+        'missing': "{} is missing",
+        'stale': "{} is out of date",
+        'phony': "it depends on the phony rule {}",
+        'changed': "{} changed",
+        'params': "its bound parameters changed",
+        'newer': "{} is newer than its targets",
+        'action': "{} is phony and has an action, so it always runs",
+    }
+
+    def __str__(self):
+        return self.messages[self.kind].format(self.subject)
+
+@functools.lru_cache(maxsize=None)
+def _code_params(code):
+    return frozenset(code.co_varnames[:code.co_argcount + code.co_kwonlyargcount])
+
+def _param_names(f):
+    """return the names of the parameters a rule's function takes.
+
+    every rule a matcher creates has a function of its own but shares its code with the rest, so the names are worked out once per code object rather than with inspect.signature on every call."""
+    func = f
+    while isinstance(func, functools.partial):
+        func = func.func
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return inspect.signature(f).parameters.keys()
+    return _code_params(code)
+
 def _filter_params(f, p):
-    sig = inspect.signature(f)
-    res = {}
-    for k, v in p.items():
-        if k in sig.parameters:
-            res[k] = v
-    return res
+    names = _param_names(f)
+    return {k: v for k, v in p.items() if k in names}
 
 class Rule(object, metaclass=abc.ABCMeta):
-    """abstract base class for makefile rules."""
+    """abstract base class for makefile rules.
+
+    a makefile can easily have thousands of rules, so rules are slotted, and every path they mention is interned in the makefile's path table."""
+    __slots__ = ('makefile', 'targets', 'deps', 'action', 'cached')
+
     def __init__(self, makefile, targets, deps, action):
         self.makefile = makefile
-        self.targets = []
-        self.deps = []
+        self.targets = tuple(map(makefile.intern_path, targets))
+        self.deps = list(map(makefile.intern_path, deps))
         self.action = action
-
-        self.targets.extend(targets)
-        self.deps.extend(deps)
+        # None unless the action's outputs can be restored from the action
+        # cache; then, the modules & functions the action uses besides its own
+        # code (see the cached decorator)
+        self.cached = None
 
     def __repr__(self):
         cls = type(self)
@@ -70,8 +147,14 @@ class Rule(object, metaclass=abc.ABCMeta):
     def depends_on(self, rule):
         """add another rule's targets as dependencies."""
         self.deps.extend(rule.targets)
+        self.makefile.invalidate_graph()
         return rule
 
+    def add_deps(self, *deps):
+        """add more dependencies, e.g. from a file matcher as files turn up."""
+        self.deps.extend(self.makefile.intern_path(dep) for dep in filter(None, deps))
+        self.makefile.invalidate_graph()
+
     @property
     @abc.abstractmethod
     def mtime(self):
@@ -79,22 +162,32 @@ class Rule(object, metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
+    def cause(self):
+        """return why the rule needs to be run, or None if it doesn't."""
+        pass
+
     def should(self):
         """return whether the rule needs to be run."""
-        pass
+        return self.cause() is not None
 
     def execute(self):
         """execute the rule."""
         # TODO makefile paramters too
-        sig = inspect.signature(self.action)
-        p = {
+        self._call({
             'target': self.targets[0],
             'targets': self.targets,
             'dep': self.deps[0] if self.deps else None,
             'deps': self.deps,
-        }
+        })
+
+    def _call(self, p):
+        """call the action with whichever of the parameters in `p` it takes.
+
+        an `async def` action is run on the makefile's event loop, and the rule finishes when it does."""
         try:
-            self.action(**_filter_params(self.action, p))
+            result = self.action(**_filter_params(self.action, p))
+            if inspect.iscoroutine(result):
+                self.makefile.loop.run(result)
         except Exception as ex:
             ex_type, ex_value, stack = sys.exc_info()
             raise RuleExecutionError(self, ex_type, ex_value, stack.tb_next)
@@ -112,67 +205,137 @@ class PhonyRule(Rule):
 
     a phony rule is always considered out of date and will always run when it appears in the dependency tree. beware: that means a file rule that depends on a phony rule will always run too.
     """
+    __slots__ = ('_trivial',)
+
+    def __init__(self, makefile, targets, deps, action):
+        super().__init__(makefile, targets, deps, action)
+        self._trivial = None
 
     @property
     def mtime(self):
         return time.time()
 
-    @classtools.reify
+    @property
     def trivial(self):
         """return whether this rule is trivial, i.e., its function body is empty."""
-        return self.action.__code__.co_code in (_empty, _empty_with_docstring)
+        if self._trivial is None:
+            self._trivial = self.action.__code__.co_code in (_empty, _empty_with_docstring)
+        return self._trivial
+
+    def cause(self):
+        for dep in self.deps:
+            if self.makefile.is_stale(self.makefile.lookup_rule(dep)):
+                return Cause('stale', dep)
+        if not self.trivial:
+            return Cause('action', self.targets[0])
+        return None
+
+class StatCache(object):
+    """remembers the result of stat-ing each file for the duration of an invocation.
+
+    file rules ask about the same files over and over (every rule that depends on a file checks it, and so does the build database), so each file is only stat-ed once until a rule that writes it runs.
+    """
+    def __init__(self):
+        self._stats = {}
 
-    def should(self):
-        for dep in map(self.makefile.lookup_rule, self.deps):
-            if dep.should():
-                return True
-        return not self.trivial
-
-def _mtime(filename):
-    if os.path.exists(filename):
-        return os.path.getmtime(filename)
-    else:
-        return 0
+    def clear(self):
+        self._stats.clear()
+
+    def forget(self, filenames):
+        for filename in filenames:
+            self._stats.pop(filename, None)
+
+    def stat(self, filename):
+        """return the stat result for a file, or None if it doesn't exist."""
+        try:
+            return self._stats[filename]
+        except KeyError:
+            pass
+        try:
+            st = os.stat(filename)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        self._stats[filename] = st
+        return st
+
+    def exists(self, filename):
+        return self.stat(filename) is not None
+
+    def mtime(self, filename):
+        st = self.stat(filename)
+        if st is not None:
+            return st.st_mtime
+        else:
+            return 0
 
 class FileRule(Rule):
     """a rule that modifies one or more files.
 
-    a file rule is considered out of date if any of its targets are older than the makefile *or* any of the rule's dependencies.
+    a file rule is considered out of date if any of its targets are missing, if any of its dependencies are out of date, or if the content of its targets or file dependencies changed since it last ran. a rule the build database hasn't seen yet falls back to comparing modification times.
     """
+    __slots__ = ()
 
-    # @classtools.reify
+    # @functools.cached_property
     @property
     def mtime(self):
         """check the modification time of all targets and return the oldest."""
-        return min(map(_mtime, self.targets))
+        return min(map(self.makefile.stats.mtime, self.targets))
 
-    def should(self):
-        if not all(map(os.path.exists, self.targets)):
-            return True
+    def file_deps(self):
+        """return the dependencies that are files rather than phony rules."""
+        return [dep for dep in self.deps
+            if isinstance(self.makefile.lookup_rule(dep), FileRule)]
+
+    def cause(self):
+        for target in self.targets:
+            if not self.makefile.stats.exists(target):
+                return Cause('missing', target)
         # elif self.makefile.mtime > self.mtime:
         #     return True
-        for dep in map(self.makefile.lookup_rule, self.deps):
-            if dep.should():
-                return True
-            elif dep.mtime > self.mtime:
-                return True
-            else:
-                return False
+        deps = list(map(self.makefile.lookup_rule, self.deps))
+        for name, dep in zip(self.deps, deps):
+            if self.makefile.is_stale(dep):
+                return Cause('stale', name)
+            elif isinstance(dep, PhonyRule):
+                return Cause('phony', name)
+        db = self.makefile.db
+        if db.known(self):
+            return db.difference(self, self.file_deps())
+        # the file itself, not its rule: a batch's mtime is its oldest target
+        mtime = self.mtime
+        for name in self.deps:
+            if self.makefile.stats.mtime(name) > mtime:
+                return Cause('newer', name)
+        db.record(self, self.file_deps())
+        return None
 
     def execute(self):
         # try:
         #     del self.mtime
         # except AttributeError:
         #     pass
-        for t in self.targets:
-            os.makedirs(os.path.dirname(t), exist_ok=True)
-        super().execute()
+        self.makefile.make_dirs(self.targets)
+        cache = self.makefile.action_cache
+        fingerprint = cache.fingerprint(self, self.cached) if self.cached is not None and cache.enabled else None
+        restored = False
+        try:
+            if fingerprint is not None:
+                restored = cache.restore(fingerprint, self.targets)
+            if not restored:
+                super().execute()
+        finally:
+            self.makefile.stats.forget(self.targets)
+        if fingerprint is not None and not restored:
+            cache.store(fingerprint, self.targets)
+        self.makefile.db.record(self, self.file_deps())
 
 class SourceFileRule(FileRule):
     """a rule that represents a single source file.
 
     a source file is never out of date because it does not depend on any other files.
     """
+    __slots__ = ()
+
     def __init__(self, makefile, filename):
         super().__init__(makefile, [filename], [], None)
 
@@ -180,13 +343,210 @@ class SourceFileRule(FileRule):
     def trivial(self):
         return True
 
-    def should(self):
-        return False
+    def cause(self):
+        return None
 
     def execute(self):
         pass
 
+class BatchItem(FileRule):
+    """one of the items a batch rule makes.
+
+    an item isn't a rule of its own as far as the makefile is concerned; the batch it belongs to stands in for it. it's only here to work out whether its own targets are up to date & to be recorded in the build database on its own.
+    """
+    __slots__ = ('batch',)
+
+    def __init__(self, batch, targets, deps):
+        super().__init__(batch.makefile, targets, deps, batch.action)
+        self.batch = batch
+
+    def execute(self):
+        raise TypeError("batch items are made by their batch rule")
+
+class BatchRule(FileRule):
+    """a rule that makes many files with a single call to its function.
+
+    the files are added to the rule a few at a time as items, each with targets & dependencies of its own. every item is checked on its own, and the function is called with a list of just the items that are out of date, so whatever it costs to get going (imports, setting up a tool, ...) is only paid once per build rather than once per file.
+
+    the batch is a single rule in the dependency graph, named after its function: anything that depends on one of its targets waits for the whole batch. items can't depend on the targets of other items in the same batch. when the build runs more than one job at a time, the out of date items are split between that many calls to the function, each on a thread of its own.
+    """
+    __slots__ = ('items', '_stale')
+
+    def __init__(self, makefile, name, action):
+        super().__init__(makefile, [name], [], action)
+        # items keep adding targets, so unlike other rules these can't be a tuple
+        self.targets = list(self.targets)
+        self.items = []
+        self._stale = None
+
+    @property
+    def mtime(self):
+        return min((item.mtime for item in self.items), default=0)
+
+    def add(self, targets, deps=()):
+        """add an item to the batch and return it.
+
+        the item can be passed to another rule's `depends_on`."""
+        item = BatchItem(self, list(map(str, filter(None, targets))), list(map(str, filter(None, deps))))
+        self.items.append(item)
+        self.targets.extend(item.targets)
+        self.deps.extend(item.deps)
+        makefile = self.makefile
+        for target in item.targets:
+            makefile.rules[target] = self
+        makefile.invalidate_graph()
+        for log in makefile._rule_logs:
+            log.append(item)
+        return item
+
+    def discard(self, item):
+        """take an item out of the batch."""
+        self.items.remove(item)
+        targets = set(item.targets)
+        self.targets[:] = [target for target in self.targets if target not in targets]
+        for dep in item.deps:
+            self.deps.remove(dep)
+        self.makefile.invalidate_graph()
+
+    def cause(self):
+        self._stale = []
+        first = None
+        for item in self.items:
+            cause = item.cause()
+            if cause is not None:
+                self._stale.append(item)
+                if first is None:
+                    first = cause
+        return first
+
+    def stale_items(self):
+        """return the items that were out of date when the rule was last checked."""
+        if self._stale is None:
+            self.cause()
+        return self._stale
+
+    def execute(self):
+        items = self.stale_items()
+        self._stale = None
+        makefile = self.makefile
+        makefile.make_dirs([target for item in items for target in item.targets])
+        cache = makefile.action_cache
+        fingerprints = {}
+        if self.cached is not None and cache.enabled:
+            fingerprints = {item: cache.fingerprint(item, self.cached) for item in items}
+        made = []
+        try:
+            for item in items:
+                fingerprint = fingerprints.get(item)
+                if fingerprint is None or not cache.restore(fingerprint, item.targets):
+                    made.append(item)
+            if made:
+                self._call_split(made)
+        finally:
+            makefile.stats.forget([target for item in items for target in item.targets])
+        for item in made:
+            if item in fingerprints:
+                cache.store(fingerprints[item], item.targets)
+        for item in items:
+            makefile.db.record(item, item.file_deps())
+
+    def _call_split(self, items):
+        # the batch is a single rule to the scheduler, so spread its items
+        # over as many threads as it would have spread the rules over
+        jobs = min(self.makefile.jobs, len(items))
+        if jobs <= 1:
+            self._call({'items': items})
+            return
+        error = None
+        with ThreadPoolExecutor(jobs) as pool:
+            futures = [pool.submit(self._call, {'items': items[i::jobs]}) for i in range(jobs)]
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    # like the scheduler, stop starting things once one fails
+                    self.makefile.loop.abort()
+                    break
+        if error is not None:
+            raise error
+
+class FileTree(object):
+    """a lazily scanned view of the directory tree.
+
+    every file matcher walks the same tree, so each directory is only listed once per load no matter how many matchers look inside it.
+    """
+    def __init__(self):
+        self._listings = {}
+        self._names = {}
+
+    def forget(self, path):
+        """drop the cached listing of the directory containing a path."""
+        dirname = os.path.dirname(path)
+        self._listings.pop(dirname, None)
+        self._names.pop(dirname, None)
+
+    def exists(self, path):
+        """return whether a file or directory exists, going by the cached listing of its parent."""
+        dirname, name = os.path.split(os.path.normpath(path))
+        try:
+            names = self._names[dirname]
+        except KeyError:
+            names = self._names[dirname] = {name for name, is_dir in self.listdir(dirname)}
+        return name in names
+
+    def listdir(self, dirname):
+        """return a sorted list of (name, is_dir) pairs for a directory's entries."""
+        try:
+            return self._listings[dirname]
+        except KeyError:
+            pass
+        entries = []
+        try:
+            with os.scandir(dirname or '.') as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry.name, is_dir))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        entries.sort()
+        self._listings[dirname] = entries
+        return entries
+
+    def walk(self, root, prune, visited=None):
+        """yield every file and directory below `root`.
+
+        directories for which `prune` returns true are neither yielded nor entered. if `visited` is given, every directory that was listed is appended to it."""
+        stack = [root]
+        while stack:
+            dirname = stack.pop()
+            if visited is not None:
+                visited.append(dirname)
+            subdirs = []
+            for name, is_dir in self.listdir(dirname):
+                path = f'{dirname}/{name}' if dirname else name
+                if is_dir:
+                    if prune(path):
+                        continue
+                    subdirs.append(path)
+                yield path
+            stack.extend(reversed(subdirs))
+
+def _glob_root(pattern):
+    """return the directory a glob pattern is rooted in, i.e., its leading components without wildcards."""
+    root = []
+    for part in Path(pattern).parts[:-1]:
+        if any(c in part for c in '*?['):
+            break
+        root.append(part)
+    return '/'.join(root)
+
 class FileMatcher(object):
+    """calls a function for every file matching a glob pattern.
+
+    the pattern and the exclusions are each compiled to a single regex up front. anything matching an excluded pattern is skipped, and so is everything inside an excluded directory.
+    """
     def __init__(self, makefile, pattern, exclude, callback):
         self.makefile = makefile
         self.pattern = pattern
@@ -195,33 +555,100 @@ class FileMatcher(object):
         self.exclude = []
         self.exclude.extend(exclude)
 
+        # the rules created for each file the callback was called with
+        self.generated = {}
+
+        self.root = _glob_root(pattern)
+        self._regex = compile_glob(pattern, hidden=False)
+        if self.exclude:
+            self._exclude_regex = re.compile(r'(?:^|(?<=/))(?:{})'.format(
+                '|'.join(translate_glob(p) for p in self.exclude)))
+        else:
+            self._exclude_regex = None
+
+    def _excluded(self, path):
+        # paths passed in here end with a slash
+        return self._exclude_regex is not None \
+            and self._exclude_regex.search(path) is not None
+
     def match(self, filename):
-        return pathmatch(filename, self.pattern) \
-            and not any(filter(functools.partial(pathmatch, filename, partial=True), self.exclude))
+        filename = Path(filename).as_posix() + '/'
+        return self._regex.match(filename) is not None \
+            and not self._excluded(filename)
+
+    def _call(self, filename):
+        with self.makefile.capture_rules() as rules:
+            self.callback(filename)
+        self.generated[str(filename)] = rules
 
     def process_file(self, filename):
+        """call the function for a file if it matches. returns whether it did."""
         filename = Path(filename)
-        if self.match(filename):
-            self.callback(filename)
+        if str(filename) not in self.generated and self.match(filename):
+            self._call(filename)
+            return True
+        else:
+            return False
+
+    def forget_file(self, filename):
+        """return the rules created for a file, forgetting that the file was ever matched."""
+        return self.generated.pop(str(filename), [])
 
     def process_all(self):
-        for filename in glob.iglob(self.pattern, recursive=True):
-            self.process_file(filename)
+        """call the function for every matching file.
+
+        the files found last time are reused if none of the directories walked to find them have changed since."""
+        cache = self.makefile.rule_cache
+        key = '\0'.join([self.pattern, *self.exclude])
+        files = cache.matches(key)
+        if files is None:
+            regex = self._regex
+            visited = []
+            files = []
+            for filename in self.makefile.tree.walk(self.root, lambda d: self._excluded(d + '/'), visited):
+                path = filename + '/'
+                if regex.match(path) and not self._excluded(path):
+                    files.append(filename)
+            cache.remember_matches(key, visited, files)
+        for filename in files:
+            self._call(Path(filename))
 
 # -------------------------------
 import functools
 
+def _decorations(makefile, f):
+    # what the decorators below @rule or @match have said about a function.
+    # it's kept on the makefile rather than on the function, since giving
+    # every rule's function an attribute dict of its own adds up
+    return makefile.decorations.setdefault(f, {})
+
 def rule(makefile, *targets):
     """create a new rule."""
     targets = list(map(str, filter(None, targets)))
     def decorator(f):
-        deps = getattr(f, '__make_deps__', [])
+        decorations = makefile.decorations.pop(f, {})
         if targets:
             factory = FileRule
         else:
             factory = PhonyRule
             targets.append(f.__name__)
-        rule = factory(makefile, targets, deps, f)
+        rule = factory(makefile, targets, decorations.get('deps', ()), f)
+        rule.cached = decorations.get('cached')
+        makefile.add_rule(rule)
+        return rule
+    return decorator
+
+def batch_rule(makefile):
+    """create a new batch rule, named after the function.
+
+    the function is called with `items`, the out of date items, each of which has `targets` & `deps`. add items with the rule's `add` method."""
+    def decorator(f):
+        decorations = makefile.decorations.pop(f, {})
+        func = f
+        while isinstance(func, functools.partial):
+            func = func.func
+        rule = BatchRule(makefile, func.__name__, f)
+        rule.cached = decorations.get('cached')
         makefile.add_rule(rule)
         return rule
     return decorator
@@ -229,9 +656,7 @@ def rule(makefile, *targets):
 def deps(makefile, *deps):
     """attach dependencies to the rule."""
     def decorator(f):
-        if not hasattr(f, '__make_deps__'):
-            f.__make_deps__ = []
-        f.__make_deps__.extend(map(str, filter(None, deps)))
+        _decorations(makefile, f).setdefault('deps', []).extend(map(str, filter(None, deps)))
         return f
     return decorator
 
@@ -241,62 +666,1104 @@ def bind_params(makefile, **params):
         return functools.partial(f, **params)
     return decorator
 
+def cached(makefile, *uses):
+    """let the rule's outputs be restored from the action cache instead of running it.
+
+    only use this for rules whose outputs depend on nothing but their dependencies, their targets, their bound parameters, their own code and the code in `uses`: the names of modules & the functions the rule calls to do its work. anything else they depend on (e.g. which program they run) should be bound with bind_params. goes directly below @rule."""
+    def decorator(f):
+        _decorations(makefile, f)['cached'] = uses
+        return f
+    return decorator
+
 def match(makefile, pattern):
     """create a new file matcher"""
     def decorator(f):
-        exclude = getattr(f, '__make_exclude__', [])
+        exclude = makefile.decorations.pop(f, {}).get('exclude', [])
         matcher = FileMatcher(makefile, pattern, exclude, f)
         makefile.add_matcher(matcher)
         return matcher
     return decorator
 
 def exclude(makefile, *patterns):
-    """attach a list of excluded patterns to the file matcher"""
+    """attach a list of excluded patterns to the file matcher.
+
+    an excluded directory is skipped entirely, along with everything inside it."""
     def decorator(f):
-        if not hasattr(f, '__make_exclude__'):
-            f.__make_exclude__ = []
-        f.__make_exclude__.extend(map(str, filter(None, patterns)))
+        _decorations(makefile, f).setdefault('exclude', []).extend(map(str, filter(None, patterns)))
         return f
     return decorator
 
+# -------------------------------
+class RuleGraph(object):
+    """a snapshot of the dependencies between a makefile's rules.
+
+    every rule is interned as an integer node with forward (the rules it depends on) and reverse (the rules that depend on it) adjacency lists, so each dependency is only looked up once no matter how many paths lead to it. dependencies that can't be resolved are set aside and only reported if something actually needs them.
+    """
+    def __init__(self, makefile):
+        self.makefile = makefile
+        self.rules = []
+        self.ids = {}
+        self.deps = []
+        self.dependents = []
+        self.missing = {}
+
+        rules = list(dict.fromkeys(makefile.rules.values()))
+        for rule in rules:
+            self._intern(rule)
+        self.nodes = {target: self.ids[rule] for target, rule in makefile.rules.items()}
+        for node, rule in enumerate(rules):
+            deps = {}
+            for dep in rule.deps:
+                other = self._resolve(dep)
+                if other is None:
+                    self.missing.setdefault(node, []).append(dep)
+                elif other not in deps:
+                    deps[other] = True
+                    self.dependents[other].append(node)
+            self.deps[node] = list(deps)
+
+    def _intern(self, rule):
+        node = self.ids[rule] = len(self.rules)
+        self.rules.append(rule)
+        self.deps.append([])
+        self.dependents.append([])
+        return node
+
+    def _resolve(self, target):
+        try:
+            return self.nodes[target]
+        except KeyError:
+            pass
+        try:
+            rule = self.makefile.lookup_rule(target)
+        except MakeError:
+            return None
+        node = self.ids.get(rule)
+        if node is None:
+            node = self._intern(rule)
+        self.nodes[target] = node
+        return node
+
+    def node(self, target):
+        """return the node of the rule that makes a target."""
+        node = self._resolve(target)
+        if node is None:
+            raise MakeError(f"no rule to make {target}")
+        return node
+
+    def collect(self, target):
+        """return the rule for a target and every rule it depends on, directly or not.
+
+        dependencies always come before the rules that need them. raises CycleError with the whole cycle if there is one."""
+        root = self.node(target)
+        # 0 = unvisited, 1 = on the current path, 2 = done
+        state = bytearray(len(self.rules))
+        state[root] = 1
+        stack = [(root, iter(self.deps[root]))]
+        order = []
+        while stack:
+            node, deps = stack[-1]
+            for dep in deps:
+                if not state[dep]:
+                    state[dep] = 1
+                    stack.append((dep, iter(self.deps[dep])))
+                    break
+                elif state[dep] == 1:
+                    path = [n for n, _ in stack]
+                    cycle = path[path.index(dep):] + [dep]
+                    raise CycleError([self.rules[n] for n in cycle])
+            else:
+                stack.pop()
+                if node in self.missing:
+                    raise MakeError(f"no rule to make {self.missing[node][0]} "
+                        f"(needed by {self.rules[node].targets[0]})")
+                state[node] = 2
+                order.append(self.rules[node])
+        return order
+
+    def downstream(self, rules):
+        """return every rule that depends on any of the given rules, directly or not."""
+        seen = set()
+        pending = [self.ids[rule] for rule in rules if rule in self.ids]
+        while pending:
+            for node in self.dependents[pending.pop()]:
+                if node not in seen:
+                    seen.add(node)
+                    pending.append(node)
+        return {self.rules[node] for node in seen}
+
+    def remove(self, rule):
+        """take a rule out of the graph and return the rules that depended on it."""
+        node = self.ids.pop(rule, None)
+        if node is None:
+            return set()
+        for dep in self.deps[node]:
+            self.dependents[dep].remove(node)
+        for other in self.dependents[node]:
+            self.deps[other].remove(node)
+        for target in rule.targets:
+            if self.nodes.get(target) == node:
+                del self.nodes[target]
+        dependents = {self.rules[other] for other in self.dependents[node]}
+        self.rules[node] = None
+        self.deps[node] = []
+        self.dependents[node] = []
+        self.missing.pop(node, None)
+        return dependents
+
+# -------------------------------
+import inspect
+import threading
+import time
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class Timing(namedtuple('Timing', 'start wall cpu worker')):
+    """how long a rule took to run: when it started (in seconds since the build started), its wall & cpu time, and which worker ran it.
+
+    cpu time is the worker thread's own, except for rules whose work happens on other threads (async actions, and batches split over several jobs). those get the whole process's cpu time, which also counts whatever else was running at the same time."""
+    pass
+
+class Scheduler(object):
+    """runs rules in dependency order on a pool of worker threads.
+
+    a rule is started as soon as every rule it depends on has finished, so independent rules can run side by side. the first rule to fail stops the scheduler from starting anything new; rules that are already running are allowed to finish before the error is raised.
+    """
+    def __init__(self, makefile, jobs=1, epoch=None):
+        self.makefile = makefile
+        self.jobs = max(1, jobs)
+        self.timings = {}
+        self.epoch = time.perf_counter() if epoch is None else epoch
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        ident = threading.get_ident()
+        with self._lock:
+            return self._workers.setdefault(ident, len(self._workers))
+
+    def _execute(self, rule):
+        worker = self._worker()
+        # an async action runs on the event loop & the threads it hands work
+        # to, and a batch may split itself over threads, so the worker would
+        # only see itself waiting
+        if inspect.iscoroutinefunction(rule.action) or (isinstance(rule, BatchRule) and self.jobs > 1):
+            clock = time.process_time
+        else:
+            clock = time.thread_time
+        start = time.perf_counter()
+        cpu = clock()
+        try:
+            rule.execute()
+        finally:
+            self.timings[rule] = Timing(start - self.epoch,
+                time.perf_counter() - start, clock() - cpu, worker)
+
+    def run(self, queue, stale, started=None, finished=None, recheck=None, skipped=None, failed=None):
+        """execute the rules in `stale`.
+
+        `queue` must be in dependency order (as returned by `Makefile._collect`) and contain every rule in `stale`. rules in the queue that aren't stale are treated as already finished.
+
+        if `recheck` is given, it's asked about each stale rule once all of its dependencies are done, and the rule is skipped if it returns false.
+
+        the callbacks are all called from the thread that called `run`, never from a worker."""
+        graph = self.makefile.graph()
+        waiting = {}
+        dependents = {rule: [] for rule in queue}
+        for rule in queue:
+            deps = {graph.rules[node] for node in graph.deps[graph.ids[rule]]}
+            deps &= dependents.keys()
+            waiting[rule] = len(deps)
+            for dep in deps:
+                dependents[dep].append(rule)
+
+        ready = deque(rule for rule in queue if not waiting[rule])
+        running = {}
+        error = None
+
+        def finish(rule):
+            for dependent in dependents[rule]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    ready.append(dependent)
+
+        with ThreadPoolExecutor(self.jobs) as pool:
+            while ready or running:
+                while ready and error is None:
+                    if ready[0] not in stale:
+                        finish(ready.popleft())
+                    elif len(running) < self.jobs:
+                        rule = ready.popleft()
+                        if recheck is not None and not recheck(rule):
+                            if skipped:
+                                skipped(rule)
+                            finish(rule)
+                            continue
+                        if started:
+                            started(rule)
+                        running[pool.submit(self._execute, rule)] = rule
+                    else:
+                        break
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rule = running.pop(future)
+                    try:
+                        future.result()
+                    except RuleExecutionError as ex:
+                        if failed:
+                            failed(rule, ex)
+                        if error is None:
+                            error = ex
+                    else:
+                        if finished:
+                            finished(rule)
+                        finish(rule)
+
+        if error is not None:
+            raise error
+
+# -------------------------------
+import os
+import subprocess
+import threading
+
+# asyncio takes a while to import and most builds never need it, so it's only
+# imported once a rule with an async action runs
+
+class EventLoop(object):
+    """an asyncio event loop for rules with `async def` actions, running in a thread of its own.
+
+    the scheduler's workers hand their coroutines over & wait for them, so a rule that awaits several things at once (say, a batch rule gathering one tool call per item) keeps them all going on one thread. `check_output` runs a subprocess the same way `subprocess.check_output` does, but at most `processes` of them at a time across every rule. `to_thread` runs blocking work (decoding an image, say) off the loop, at most `threads` at a time.
+    """
+    def __init__(self, processes=None, threads=1):
+        self.processes = processes or os.cpu_count() or 1
+        self.threads = threads
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._thread_semaphore = None
+        self._waiting = set()
+        self._closing = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name='pancake-loop', daemon=True)
+                self._thread.start()
+                self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """run a coroutine on the loop and wait for its result."""
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self._start()).result()
+
+    def abort(self):
+        """cancel whatever's queued for a subprocess or a thread, and refuse anything asked for from now on, until the loop is closed.
+
+        everything that already started is left to finish."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._abort)
+
+    def _abort(self):
+        # only tasks still queued are cancelled. cancelling one that's
+        # halfway through starting its subprocess can leave asyncio waiting
+        # forever for it to exit
+        self._closing = True
+        for task in self._waiting:
+            task.cancel()
+
+    def close(self):
+        """cancel whatever the rules left behind (a rule that failed may have left some of its tasks running) and stop the loop."""
+        if self._loop is None:
+            return
+        self.run(self._cancel_all())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = self._semaphore = self._thread_semaphore = None
+        self._closing = False
+
+    async def _cancel_all(self):
+        # see _abort; whatever it leaves running (including anything in a
+        # thread) is waited for
+        import asyncio
+        self._abort()
+        while True:
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            if not tasks:
+                break
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _acquire(self, semaphore):
+        import asyncio
+        if self._closing:
+            raise asyncio.CancelledError()
+        task = asyncio.current_task()
+        self._waiting.add(task)
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting.discard(task)
+
+    async def check_output(self, args):
+        """run a command & return its output, raising CalledProcessError if it fails."""
+        import asyncio
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.processes)
+        await self._acquire(self._semaphore)
+        try:
+            proc = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE)
+            output, _ = await proc.communicate()
+        finally:
+            self._semaphore.release()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, args, output)
+        return output
+
+    async def to_thread(self, func, *args):
+        """call a function on another thread & return its result."""
+        import asyncio
+        if self._thread_semaphore is None:
+            self._thread_semaphore = asyncio.Semaphore(self.threads)
+        await self._acquire(self._thread_semaphore)
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self._thread_semaphore.release()
+
 # -------------------------------
 import functools
-import progressbar
+import json
+
+from collections import defaultdict
+
+def rule_family(rule):
+    """return the name of the function behind a rule. every rule a matcher creates shares one."""
+    action = rule.action
+    while isinstance(action, functools.partial):
+        action = action.func
+    return getattr(action, '__name__', type(rule).__name__)
+
+def write_trace(filename, timings, checks):
+    """write rule timings as chrome trace events, which perfetto & chrome://tracing can both open.
+
+    every worker gets a track of its own, and staleness checks get one more."""
+    events = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 0, 'args': {'name': "checks"}},
+    ]
+    for worker in sorted({timing.worker for timing in timings.values()}):
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': worker + 1,
+            'args': {'name': f"worker {worker}"}})
+    for rule, (start, duration) in checks.items():
+        events.append({'name': rule.targets[0], 'cat': 'check', 'ph': 'X', 'pid': 1, 'tid': 0,
+            'ts': start * 1e6, 'dur': duration * 1e6})
+    for rule, timing in timings.items():
+        events.append({'name': rule.targets[0], 'cat': rule_family(rule), 'ph': 'X',
+            'pid': 1, 'tid': timing.worker + 1,
+            'ts': timing.start * 1e6, 'dur': timing.wall * 1e6,
+            'args': {'cpu_ms': timing.cpu * 1e3, 'targets': rule.targets}})
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def timing_summary(timings, checks, limit=10):
+    """yield the lines of a table of the slowest rules, then the total time spent on each family of rules."""
+    slowest = sorted(timings.items(), key=lambda item: item[1].wall, reverse=True)
+    yield f"{'wall':>9}  {'cpu':>9}  slowest rules"
+    for rule, timing in slowest[:limit]:
+        yield f"{timing.wall:8.3f}s  {timing.cpu:8.3f}s  {rule.targets[0]}"
+
+    families = defaultdict(lambda: [0, 0.0, 0.0])
+    for rule, timing in timings.items():
+        family = families[rule_family(rule)]
+        family[0] += 1
+        family[1] += timing.wall
+        family[2] += timing.cpu
+    yield ''
+    yield f"{'wall':>9}  {'cpu':>9}  {'rules':>6}  family"
+    for name, (count, wall, cpu) in sorted(families.items(), key=lambda item: item[1][1], reverse=True):
+        yield f"{wall:8.3f}s  {cpu:8.3f}s  {count:>6}  {name}"
+
+    checked = sum(duration for start, duration in checks.values())
+    yield ''
+    yield f"{checked:8.3f}s spent checking whether {len(checks)} rules were stale"
+
+def explain_rules(makefile, rules):
+    """work out why each of the rules ran.
+
+    every rule gets a record with the first cause it gave and the chain of out of date dependencies behind it. file rules whose chain ends at a phony rule only ran because of that phony rule, and are counted against it."""
+    records = []
+    phony = defaultdict(int)
+    for rule in rules:
+        cause = makefile.causes.get(rule)
+        if cause is None:
+            continue
+        record = {'target': rule.targets[0], 'kind': cause.kind, 'cause': str(cause), 'chain': []}
+        seen = {rule}
+        while cause.kind == 'stale':
+            dep = makefile.lookup_rule(cause.subject)
+            cause = makefile.causes.get(dep)
+            if cause is None or dep in seen:
+                break
+            seen.add(dep)
+            record['chain'].append({'target': dep.targets[0], 'kind': cause.kind, 'cause': str(cause)})
+        if isinstance(rule, FileRule) and cause is not None and cause.kind in ('phony', 'action'):
+            record['phony'] = cause.subject
+            phony[cause.subject] += 1
+        records.append(record)
+    return {'rules': records, 'phony': dict(phony)}
+
+def explain_lines(report):
+    """yield the lines of an explanation as returned by `explain_rules`."""
+    for record in report['rules']:
+        yield f"{record['target']}: {record['cause']}"
+        for link in record['chain']:
+            yield f"    {link['target']}: {link['cause']}"
+    if report['phony']:
+        yield ''
+        for name, count in sorted(report['phony'].items(), key=lambda item: item[1], reverse=True):
+            yield f"{count} file rules only ran because of the phony rule {name}"
+
+# -------------------------------
+import json
+import sys
 import time
 
-from collections import OrderedDict
+class Reporter(object):
+    """tells someone how a build is going.
+
+    the makefile calls `begin` with the number of stale rules, then `start` as each rule starts and one of `finish`, `skip` (a rule turned out to be up to date once its dependencies were done) or `fail` as it ends, then `end`. every event comes from the same thread.
+
+    this one ignores all of them, so it doubles as the quiet reporter.
+    """
+    def begin(self, total, epoch):
+        pass
+
+    def start(self, rule):
+        pass
+
+    def finish(self, rule, timing):
+        pass
+
+    def skip(self, rule):
+        pass
+
+    def fail(self, rule, error):
+        pass
+
+    def end(self):
+        pass
+
+QuietReporter = Reporter
+
+class ProgressReporter(Reporter):
+    """prints each rule as it starts, under a progress bar."""
+    def begin(self, total, epoch):
+        import progressbar
+        self._failed = False
+        self._bar = progressbar.ProgressBar(
+            redirect_stdout=True,
+            max_value=total,
+            widgets=[
+                progressbar.SimpleProgress("%(value_s)s/%(max_value_s)s"),
+                progressbar.Bar(left=" ├", right="┤ ", marker="█", fill="─"),
+                progressbar.AdaptiveETA(),
+            ])
+        self._bar.start()
+
+    def start(self, rule):
+        print(f"=> {rule.targets[0]}")
+
+    def finish(self, rule, timing):
+        self._bar.update(self._bar.value + 1)
+
+    def skip(self, rule):
+        self._bar.update(self._bar.value + 1)
+
+    def fail(self, rule, error):
+        self._failed = True
+
+    def end(self):
+        self._bar.finish(dirty=self._failed)
+
+class JsonLinesReporter(Reporter):
+    """writes every event to a file as a line of json, for dashboards & whatever else wants to read them.
+
+    events are buffered and written `buffer` at a time (and at the end of the build), so a big build doesn't make a write per rule. times are in seconds since the build started."""
+    def __init__(self, file=None, buffer=256):
+        self.file = file or sys.stdout
+        self.buffer = buffer
+        self._events = []
+
+    def _emit(self, event, **fields):
+        self._events.append(json.dumps({'event': event, 'time': round(time.perf_counter() - self._epoch, 6), **fields}))
+        if len(self._events) >= self.buffer:
+            self.flush()
 
-try:
-    from watchdog.observers import Observer
-    from watchdog.events import PatternMatchingEventHandler, FileSystemEventHandler
-except ModuleNotFoundError:
-    have_watchdog = False
-else:
-    have_watchdog = True
+    def flush(self):
+        if self._events:
+            self.file.write('\n'.join(self._events) + '\n')
+            self.file.flush()
+            self._events.clear()
+
+    def begin(self, total, epoch):
+        self._epoch = epoch
+        self._counts = {'finished': 0, 'skipped': 0, 'failed': 0}
+        self._emit('begin', rules=total)
+
+    def start(self, rule):
+        self._emit('start', target=rule.targets[0])
+
+    def finish(self, rule, timing):
+        self._counts['finished'] += 1
+        self._emit('finish', target=rule.targets[0], family=rule_family(rule),
+            wall=timing.wall, cpu=timing.cpu, worker=timing.worker)
+
+    def skip(self, rule):
+        self._counts['skipped'] += 1
+        self._emit('skip', target=rule.targets[0])
+
+    def fail(self, rule, error):
+        self._counts['failed'] += 1
+        self._emit('fail', target=rule.targets[0],
+            error=''.join(error.info.format_exception_only()).strip())
+
+    def end(self):
+        self._emit('end', **self._counts)
+        self.flush()
+
+reporters = {
+    'bar': ProgressReporter,
+    'quiet': QuietReporter,
+    'json': JsonLinesReporter,
+}
+
+# -------------------------------
+import functools
+import hashlib
+import json
+import os
+import threading
+
+def _hash_file(filename):
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, 1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class BuildDatabase(object):
+    """remembers what every file rule read and wrote the last time it ran.
+
+    each file's digest is stored next to its size and modification time, so a file that hasn't been touched since it was last seen is never read again. touching a file or checking it out again only costs a rehash; the rules that use it only run if the content actually changed.
+    """
+    version = 1
+
+    def __init__(self, filename, stats):
+        self.filename = filename
+        self.stats = stats
+        self.files = {}
+        self.rules = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.version:
+            self.files = data['files']
+            self.rules = data['rules']
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with self._lock:
+            data = {
+                'version': self.version,
+                'files': self.files,
+                'rules': self.rules,
+            }
+            tmp = f'{self.filename}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.filename)
+            self._dirty = False
+
+    def digest(self, filename):
+        """return the digest of a file's content, or None if it doesn't exist."""
+        st = self.stats.stat(filename)
+        if st is None:
+            return None
+        entry = self.files.get(filename)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        digest = _hash_file(filename)
+        with self._lock:
+            self.files[filename] = [st.st_mtime_ns, st.st_size, digest]
+            self._dirty = True
+        return digest
+
+    def _state(self, rule, deps):
+        state = {
+            'deps': {dep: self.digest(dep) for dep in deps},
+            'targets': {target: self.digest(target) for target in rule.targets},
+        }
+        params = getattr(rule.action, 'keywords', None)
+        if params:
+            # values bound with bind_params count as inputs too
+            state['params'] = hashlib.blake2b(
+                repr(sorted(params.items())).encode(), digest_size=16).hexdigest()
+        return state
+
+    def known(self, rule):
+        """return whether the rule has been recorded before."""
+        return rule.targets[0] in self.rules
+
+    def changed(self, rule, deps):
+        """return whether any of the rule's file dependencies, targets or bound parameters differ from when it was recorded."""
+        return self.difference(rule, deps) is not None
+
+    def difference(self, rule, deps):
+        """return the first thing about the rule that differs from when it was recorded as a Cause, or None if nothing does."""
+        old = self.rules.get(rule.targets[0], {})
+        new = self._state(rule, deps)
+        for key in ('deps', 'targets'):
+            before = old.get(key, {})
+            for name, digest in new[key].items():
+                if before.get(name) != digest:
+                    return Cause('changed', name)
+            for name in before.keys() - new[key].keys():
+                return Cause('changed', name)
+        if old.get('params') != new.get('params'):
+            return Cause('params', None)
+        return None
+
+    def record(self, rule, deps):
+        """remember the current content of the rule's file dependencies and targets."""
+        state = self._state(rule, deps)
+        with self._lock:
+            self.rules[rule.targets[0]] = state
+            self._dirty = True
+
+def _dir_mtime(dirname):
+    try:
+        return os.stat(dirname or '.').st_mtime_ns
+    except OSError:
+        return None
+
+class RuleCache(object):
+    """remembers the rules a makefile defined and the files each of its matchers found.
+
+    nothing in the cache is trusted unless the makefile and the local modules it imports still hash the same. on top of that, a matcher's files are only reused while none of the directories it walked have been modified, since adding, removing or renaming a file is what changes a directory's modification time.
+
+    actions are closures, so the makefile still has to run to make anything, but listing its rules can be answered from the cache alone.
+    """
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sources = {}
+        self.matchers = {}
+        self.rules = []
+        self.valid = False
+        self._dirty = False
+
+    def load(self, makefile):
+        """read the cache, keeping it only if it was written for the same makefile."""
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.valid = data.get('version') == self.version \
+            and makefile in data['sources'] \
+            and all(os.path.exists(source) and _hash_file(source) == digest
+                for source, digest in data['sources'].items())
+        if self.valid:
+            self.sources = data['sources']
+            self.matchers = data['matchers']
+            self.rules = data['rules']
+        else:
+            self.sources = {}
+            self.matchers = {}
+            self.rules = []
+        return self.valid
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        data = {
+            'version': self.version,
+            'sources': self.sources,
+            'matchers': self.matchers,
+            'rules': self.rules,
+        }
+        tmp = f'{self.filename}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.filename)
+        self._dirty = False
+
+    def _unchanged(self, key):
+        entry = self.matchers.get(key)
+        return entry is not None and all(_dir_mtime(dirname) == mtime
+            for dirname, mtime in entry['dirs'].items())
+
+    def matches(self, key):
+        """return the files a matcher found last time, or None if they might be out of date."""
+        if self._unchanged(key):
+            return self.matchers[key]['files']
+        else:
+            return None
+
+    def remember_matches(self, key, dirs, files):
+        self.matchers[key] = {
+            'dirs': {dirname: _dir_mtime(dirname) for dirname in dirs},
+            'files': files,
+        }
+        self._dirty = True
+
+    def remember_rules(self, makefile, sources):
+        """take a snapshot of a makefile's rules and of the files that defined them."""
+        rules = [[list(rule.targets), rule.deps, isinstance(rule, FileRule)]
+            for rule in dict.fromkeys(makefile.rules.values())
+            if not isinstance(rule, SourceFileRule)]
+        sources = {source: _hash_file(source) for source in sources}
+        if rules != self.rules or sources != self.sources:
+            self.rules = rules
+            self.sources = sources
+            self._dirty = True
+
+    def listing(self):
+        """return (name, is_file) for each cached rule, the default rule first, or None if the cache might be out of date."""
+        if self.valid and self.rules and all(map(self._unchanged, self.matchers)):
+            return [(targets[0], is_file) for targets, deps, is_file in self.rules]
+        else:
+            return None
+
+# -------------------------------
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+
+def _update_code(h, code):
+    # code objects' reprs include their address, so hash their insides
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _update_code(h, const)
+        else:
+            h.update(repr(const).encode())
+
+class ActionCache(object):
+    """a content-addressed store of rule outputs, keyed by a fingerprint of everything that went into making them.
+
+    the fingerprint covers the rule's code, its targets, its bound parameters and the content of its dependencies. outputs are stored once per distinct content under `objects/`, and each fingerprint maps targets to objects under `actions/`. everything is written to a temporary file first and moved into place, so several builds can share one directory, e.g. on a network mount.
+
+    storing or restoring outputs marks their objects & action as recently used; `trim` removes the least recently used of either until the whole store fits in `max_size` bytes, then any action left pointing at an object that's gone.
+    """
+    def __init__(self, directory, db, max_size=512 << 20):
+        self.directory = directory
+        self.db = db
+        self.max_size = max_size
+        self._stored = False
+        self._modules = {}
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_size > 0
+
+    def _module_digest(self, name):
+        try:
+            return self._modules[name]
+        except KeyError:
+            pass
+        spec = importlib.util.find_spec(name)
+        if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+            raise ValueError(f"can't find the source of module {name}")
+        digest = self._modules[name] = _hash_file(spec.origin)
+        return digest
+
+    def fingerprint(self, rule, uses=()):
+        """return the fingerprint of a rule's outputs. `uses` lists the modules (by name) & functions the rule's action calls."""
+        action = rule.action
+        params = {}
+        while isinstance(action, functools.partial):
+            params = {**action.keywords, **params}
+            action = action.func
+        h = hashlib.blake2b(digest_size=16)
+        h.update(getattr(action, '__qualname__', repr(action)).encode())
+        if hasattr(action, '__code__'):
+            _update_code(h, action.__code__)
+        for used in uses:
+            if isinstance(used, str):
+                h.update(used.encode())
+                h.update(self._module_digest(used).encode())
+            else:
+                while isinstance(used, functools.partial):
+                    used = used.func
+                h.update(getattr(used, '__qualname__', repr(used)).encode())
+                _update_code(h, used.__code__)
+        h.update(repr(rule.targets).encode())
+        h.update(repr(sorted(params.items())).encode())
+        for dep in rule.deps:
+            h.update(dep.encode())
+            if isinstance(rule.makefile.lookup_rule(dep), FileRule):
+                h.update(repr(self.db.digest(dep)).encode())
+        return h.hexdigest()
+
+    def _path(self, kind, digest):
+        return os.path.join(self.directory, kind, digest[:2], digest[2:])
+
+    def _put(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def restore(self, fingerprint, targets):
+        """copy a fingerprint's outputs into place. returns false if they aren't all in the cache."""
+        try:
+            with open(self._path('actions', fingerprint)) as f:
+                outputs = json.load(f)
+        except (OSError, ValueError):
+            return False
+        objects = [self._path('objects', outputs.get(target, '')) for target in targets]
+        if not all(map(os.path.isfile, objects)):
+            return False
+        for target, obj in zip(targets, objects):
+            with open(obj, 'rb') as src:
+                self._put(os.path.abspath(target), lambda dst: shutil.copyfileobj(src, dst))
+            os.utime(obj)
+        os.utime(self._path('actions', fingerprint))
+        return True
+
+    def store(self, fingerprint, targets):
+        """remember a rule's outputs under its fingerprint."""
+        outputs = {}
+        for target in targets:
+            digest = self.db.digest(target)
+            if digest is None:
+                return
+            obj = self._path('objects', digest)
+            try:
+                # already there, but in use again, so it shouldn't be trimmed first
+                os.utime(obj)
+            except FileNotFoundError:
+                with open(target, 'rb') as src:
+                    self._put(obj, lambda dst: shutil.copyfileobj(src, dst))
+            outputs[target] = digest
+        self._put(self._path('actions', fingerprint),
+            lambda f: f.write(json.dumps(outputs).encode()))
+        self._stored = True
+
+    def _entries(self, kind):
+        root = os.path.join(self.directory, kind)
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def trim(self):
+        """remove the least recently used objects & actions until the store fits in `max_size`, then the actions whose objects are gone."""
+        if not self._stored:
+            return
+        self._stored = False
+        entries = [*self._entries('objects'), *self._entries('actions')]
+        total = sum(size for mtime, size, path in entries)
+        trimmed = False
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            trimmed = True
+        if trimmed:
+            self._prune_actions()
+
+    def _prune_actions(self):
+        # an action is no use once any of its objects has been trimmed, by
+        # this build or another one sharing the directory
+        for mtime, size, path in self._entries('actions'):
+            try:
+                with open(path) as f:
+                    outputs = json.load(f)
+                if all(os.path.isfile(self._path('objects', digest)) for digest in outputs.values()):
+                    continue
+                os.unlink(path)
+            except (OSError, ValueError):
+                pass
+
+# -------------------------------
+import contextlib
+import functools
+import os
+import sys
+import time
+
+from queue import Empty, Queue
+
+# progressbar (see ProgressReporter) and watchdog are only imported once
+# something needs them, so commands that never build anything start up quickly
 
 class MakeError(RuntimeError):
     pass
 
-decorators = [rule, deps, bind_params, match, exclude]
+class CycleError(MakeError):
+    def __init__(self, cycle):
+        self.cycle = cycle
+        path = ' -> '.join(rule.targets[0] for rule in cycle)
+        super().__init__(f"cyclical dependency detected: {path}")
+
+decorators = [rule, batch_rule, deps, bind_params, cached, match, exclude]
+
+def _local_modules():
+    """return the files of every module imported from below the working directory."""
+    files = set()
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None)
+        if filename and os.path.isfile(filename):
+            path = os.path.relpath(filename)
+            if not path.startswith('..') and not os.path.isabs(path):
+                files.add(path)
+    return sorted(files)
 
 class Makefile(object):
     def __init__(self):
         self.mtime = 0
-        self.rules = OrderedDict()
+        self.rules = {}
+        self.paths = {}
+        self.decorations = {}
         self.matchers = []
+        self.tree = FileTree()
+        self.stats = StatCache()
+        self.db = BuildDatabase(os.path.join('.pancake', 'db'), self.stats)
+        self.rule_cache = RuleCache(os.path.join('.pancake', 'rules'))
+        self.action_cache = ActionCache(os.path.join('.pancake', 'cache'), self.db)
+        self._graph = None
+        self.causes = {}
+        self.ran = set()
+        self.epoch = time.perf_counter()
+        self.timings = {}
+        self.checks = {}
+        self._rule_logs = []
+        self._dirs = set()
+        self.jobs = 1
+        self.loop = EventLoop()
+        self.reporter = ProgressReporter()
         self._injected_locals = {'makefile':self}
         self._injected_locals.update(
             {f.__name__:functools.partial(f, self) for f in decorators})
 
     def load(self, filename):
         self.mtime = os.path.getmtime(filename)
+        self.db.load()
+        self.rule_cache.load(filename)
         with open(filename) as srcfile:
             code = compile(srcfile.read(), filename, 'exec')
         exec(code, {**self._injected_locals})
+        self.rule_cache.remember_rules(self, [filename, *_local_modules()])
+        self.rule_cache.save()
+
+    def intern_path(self, path):
+        """return the copy of a path the makefile already has, so equal paths are only stored once."""
+        path = str(path)
+        return self.paths.setdefault(path, path)
 
     def add_rule(self, rule):
         for target in rule.targets:
             self.rules[target] = rule
+        self._graph = None
+        for log in self._rule_logs:
+            log.append(rule)
+
+    @contextlib.contextmanager
+    def capture_rules(self):
+        """collect every rule added inside a with block into a list."""
+        log = []
+        self._rule_logs.append(log)
+        try:
+            yield log
+        finally:
+            self._rule_logs.remove(log)
+
+    def remove_rule(self, rule):
+        """remove a rule and scrub its targets from the rules that depended on them.
+
+        returns the rules that were scrubbed."""
+        graph = self.graph()
+        if isinstance(rule, BatchItem):
+            return self._remove_item(graph, rule)
+        for target in rule.targets:
+            if self.rules.get(target) is rule:
+                del self.rules[target]
+        scrubbed = graph.remove(rule)
+        targets = set(rule.targets)
+        for other in scrubbed:
+            other.deps[:] = [dep for dep in other.deps if dep not in targets]
+        return scrubbed
+
+    def _remove_item(self, graph, item):
+        batch = item.batch
+        targets = set(item.targets)
+        for target in targets:
+            if self.rules.get(target) is batch:
+                del self.rules[target]
+        scrubbed = set()
+        node = graph.ids.get(batch)
+        if node is not None:
+            for other in graph.dependents[node]:
+                other = graph.rules[other]
+                if not targets.isdisjoint(other.deps):
+                    other.deps[:] = [dep for dep in other.deps if dep not in targets]
+                    scrubbed.add(other)
+        batch.discard(item)
+        return scrubbed
+
+    def make_dirs(self, paths):
+        """create the directories the given paths go in, skipping any already created during this invocation."""
+        for dirname in {os.path.dirname(path) for path in paths}:
+            if dirname and dirname not in self._dirs:
+                os.makedirs(dirname, exist_ok=True)
+                self._dirs.add(dirname)
+
+    def graph(self):
+        """return the dependency graph, building it again if any rules changed since it was last asked for."""
+        if self._graph is None:
+            self._graph = RuleGraph(self)
+        return self._graph
+
+    def invalidate_graph(self):
+        self._graph = None
 
     def add_matcher(self, matcher):
         self.matchers.append(matcher)
@@ -307,7 +1774,7 @@ class Makefile(object):
             return self.rules[target]
         elif target == 'default':
             return self.default_rule()
-        elif os.path.exists(target):
+        elif self.tree.exists(target):
             rule = SourceFileRule(self, target)
             self.add_rule(rule)
             return rule
@@ -321,77 +1788,189 @@ class Makefile(object):
         else:
             raise MakeError("there are no rules")
 
-    def invoke(self, target='default', watch=False):
+    def invoke(self, target='default', watch=False, jobs=1):
         if watch:
-            return self._watch(target)
+            return self._watch(target, jobs)
         else:
             queue = self._collect(target)
-            return self._invoke_queue(queue)
+            return self._invoke_queue(queue, jobs)
 
     def _collect(self, target):
-        def collect(target, queue=OrderedDict(), chain=OrderedDict()):
-            rule = self.lookup_rule(target)
-            if rule in chain:
-                raise MakeError("cyclical dependency detected")
-            else:
-                queue[rule] = True
-                queue.move_to_end(rule)
-                chain[rule] = True
-                for dep in rule.deps:
-                    collect(dep, queue, chain)
-                chain.popitem(last=True)
-            return queue
-        return list(reversed(collect(target)))
-
-    def _watch(self, target):
-        queue = self._collect(target)
-        observer = Observer()
-
-        def on_created(event):
-            nonlocal queue
-            for matcher in self.matchers:
-                matcher.process_file(event.src_path)
-            queue = self._collect(target)
+        return self.graph().collect(target)
 
-        def on_modified(event):
-            rule = self.lookup_rule(event.src_path)
-            if isinstance(rule, SourceFileRule):
-                self._invoke_queue(queue)
+    def _watch(self, target, jobs=1, delay=0.2):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ModuleNotFoundError:
+            raise MakeError("watching for changes needs the watchdog package")
+        events = Queue()
+
+        def on_event(event):
+            if not event.is_directory:
+                events.put(event.src_path)
+                if getattr(event, 'dest_path', None):
+                    events.put(event.dest_path)
 
         handler = FileSystemEventHandler()
-        handler.on_created = on_created
-        handler.on_modified = on_modified
+        handler.on_created = on_event
+        handler.on_modified = on_event
+        handler.on_deleted = on_event
+        handler.on_moved = on_event
+
+        observer = Observer()
         observer.schedule(handler, '.', recursive=True)
 
-        self._invoke_queue(queue)
+        queue = self._collect(target)
+        self._watch_invoke(queue, jobs)
 
         observer.start()
-        observer.join()
+        try:
+            while True:
+                # editors tend to save in bursts, so wait for things to settle
+                paths = {events.get()}
+                while True:
+                    try:
+                        paths.add(events.get(timeout=delay))
+                    except Empty:
+                        break
+
+                dirty, graph_changed = self._apply_changes(paths)
+                if not dirty:
+                    continue
+                if graph_changed:
+                    queue = self._collect(target)
+                affected = dirty | self.graph().downstream(dirty)
+                self._watch_invoke([rule for rule in queue if rule in affected], jobs)
+        finally:
+            observer.stop()
+            observer.join()
         return True
 
-    def _invoke_queue(self, queue):
-        queue = list(filter(lambda rule: rule.should(), queue))
-        if not queue:
+    def _watch_invoke(self, queue, jobs):
+        try:
+            self._invoke_queue(queue, jobs)
+        except MakeError as ex:
+            print(f"error: {ex}")
+        except RuleExecutionError as ex:
+            print(f"something went wrong while making {ex.rule.targets[0]}:")
+            print(''.join(ex.info.format()))
+
+    def _apply_changes(self, paths):
+        """bring the rules up to date with a batch of changed files.
+
+        new files are offered to the matchers. the rules created for deleted files are removed, and so are their targets. returns the rules that use the changed files directly, and whether any rules were added or removed."""
+        dirty = set()
+        removed = set()
+        deleted = []
+        sources = set()
+        graph_changed = False
+        for path in paths:
+            path = os.path.relpath(path)
+            rule = self.rules.get(path)
+            if rule is not None and not isinstance(rule, SourceFileRule):
+                # a build product; the build itself is what changed it
+                continue
+            self.tree.forget(path)
+            if os.path.isfile(path):
+                if rule is None:
+                    # a rule might have been waiting for this file to show up
+                    self.invalidate_graph()
+                for matcher in self.matchers:
+                    graph_changed |= matcher.process_file(path)
+            else:
+                for matcher in self.matchers:
+                    for generated in matcher.forget_file(path):
+                        dirty |= self.remove_rule(generated)
+                        removed.add(generated)
+                        for target in generated.targets:
+                            if isinstance(generated, FileRule) and os.path.isfile(target):
+                                os.remove(target)
+                        graph_changed = True
+                if rule is not None:
+                    deleted.append(rule)
+            sources.add(path)
+
+        graph = self.graph()
+        for path in sources:
+            node = graph.nodes.get(path)
+            if node is not None:
+                dirty.update(graph.rules[other] for other in graph.dependents[node])
+        # rules that used a deleted source keep depending on it, so they fail
+        # loudly instead of quietly building without it
+        for rule in deleted:
+            del self.rules[rule.targets[0]]
+            self.invalidate_graph()
+        return dirty - removed, graph_changed
+
+    def is_stale(self, rule):
+        """return whether a rule needs to run, asking each rule at most once per invocation.
+
+        the reason each rule gave is kept in `causes`. a rule that already ran during this invocation is up to date."""
+        if rule in self.ran:
+            return False
+        try:
+            return self.causes[rule] is not None
+        except KeyError:
+            pass
+        start = time.perf_counter()
+        cause = self.causes[rule] = rule.cause()
+        self.checks[rule] = (start - self.epoch, time.perf_counter() - start)
+        return cause is not None
+
+    def restat(self, rule):
+        """check again whether a rule needs to run now that its dependencies have.
+
+        a rule that was only stale because its dependencies were might not be any more: a dependency that ran and left its outputs exactly as they were doesn't change anything downstream of it."""
+        cause = self.causes.get(rule)
+        if cause is None or cause.kind != 'stale':
+            return cause is not None
+        del self.causes[rule]
+        return self.is_stale(rule)
+
+    def _invoke_queue(self, queue, jobs=1):
+        self.stats.clear()
+        self.causes = {}
+        self.ran = set()
+        self.epoch = time.perf_counter()
+        self.timings = {}
+        self.checks = {}
+        self._dirs = set()
+        self.jobs = self.loop.threads = max(1, jobs)
+        # the queue lists dependencies before the rules that need them, so
+        # every dependency's answer is already memoized by the time it's asked
+        stale = set(filter(self.is_stale, queue))
+        if not stale:
+            # checking may still have rehashed files that were only touched,
+            # or recorded rules by their modification times
+            self.db.save()
             return False
 
-        progress = progressbar.ProgressBar(
-            redirect_stdout=True,
-            max_value=len(queue),
-            widgets=[
-                progressbar.SimpleProgress("%(value_s)s/%(max_value_s)s"),
-                progressbar.Bar(left=" ├", right="┤ ", marker="█", fill="─"),
-                progressbar.AdaptiveETA(),
-            ])
-        with progress:
-            for i, rule in enumerate(queue):
-                print(f"=> {rule.targets[0]}")
-                rule.execute()
-                progress.update(i + 1)
+        reporter = self.reporter
+        scheduler = Scheduler(self, jobs, self.epoch)
+
+        def finished(rule):
+            self.ran.add(rule)
+            reporter.finish(rule, scheduler.timings[rule])
+
+        reporter.begin(len(stale), self.epoch)
+        try:
+            scheduler.run(queue, stale, reporter.start, finished, self.restat, reporter.skip, reporter.fail)
+        finally:
+            reporter.end()
+            self.timings = scheduler.timings
+            self.db.save()
+            self.action_cache.trim()
+            self.loop.close()
 
         return True
 
 # -------------------------------
 import click
+import contextlib
+import functools
+import json
+import sys
 
 class PancakeCommand(click.Group):
     def get_command(self, ctx, name):
@@ -403,8 +1982,10 @@ class PancakeCommand(click.Group):
                 context_settings=dict(
                     ignore_unknown_options=True,
                     allow_extra_args=True))
-            def _cmd():
-                ctx.invoke(make, target=name)
+            @click.pass_context
+            def _cmd(ctx, **options):
+                ctx.invoke(make, target=name, **options)
+            _cmd.params.extend(p for p in make.params if p.name != 'target')
             return _cmd
 
 @click.group(
@@ -417,33 +1998,115 @@ class PancakeCommand(click.Group):
     type=click.Path(exists=True))
 @click.pass_context
 def pancake_cli(ctx, filename):
-    makefile = Makefile()
-    makefile.load(filename)
-    ctx.obj = makefile
+    ctx.obj = {'filename': filename}
     if not ctx.invoked_subcommand:
-        ctx.invoke(make)
+        # parse an empty command line rather than ctx.invoke(make), which
+        # would skip the options' environment variables
+        with make.make_context('make', [], parent=ctx) as make_ctx:
+            make.invoke(make_ctx)
+
+def load_makefile(ctx):
+    """load the makefile the first time a command needs it."""
+    if 'makefile' not in ctx.obj:
+        makefile = Makefile()
+        makefile.load(ctx.obj['filename'])
+        ctx.obj['makefile'] = makefile
+    return ctx.obj['makefile']
 
 @pancake_cli.command(
     help="run a task (default)")
 @click.option('-w', '--watch',
     help="watch for changes to any files in the dependency tree and automatically re-run when they occur",
     is_flag=True)
+@click.option('-j', '--jobs',
+    help="number of rules to run at once (0 to use every cpu)",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=0))
+@click.option('--trace',
+    help="write how long each rule took to a chrome trace file",
+    type=click.Path(dir_okay=False, writable=True))
+@click.option('--summary',
+    help="list the slowest rules & the time spent on each kind of rule",
+    is_flag=True)
+@click.option('--explain',
+    help="say why each rule that ran had to run",
+    is_flag=True)
+@click.option('--explain-json',
+    help="write why each rule that ran had to run to a json file",
+    type=click.Path(dir_okay=False, writable=True))
+@click.option('--cache', 'cache_dir',
+    help="directory to keep the action cache in; point it at a shared directory to share outputs between checkouts",
+    default=os.path.join('.pancake', 'cache'),
+    show_default=True,
+    envvar='PANCAKE_CACHE')
+@click.option('--cache-size',
+    help="how big the action cache may grow, in megabytes (0 to turn it off)",
+    default=512,
+    show_default=True,
+    envvar='PANCAKE_CACHE_SIZE',
+    type=click.IntRange(min=0))
+@click.option('-p', '--processes',
+    help="number of subprocesses rules with async actions may run at once (0 to use every cpu)",
+    default=0,
+    show_default=True,
+    envvar='PANCAKE_PROCESSES',
+    type=click.IntRange(min=0))
+@click.option('--reporter', 'reporter_name',
+    help="how to report progress: a progress bar, nothing at all, or a json line per event",
+    type=click.Choice(list(reporters)),
+    default='bar',
+    show_default=True,
+    envvar='PANCAKE_REPORTER')
+@click.option('--events',
+    help="write json lines to this file instead of stdout (implies --reporter json)",
+    type=click.File('w'))
 @click.argument('target', default='default')
 @click.pass_context
-def make(ctx, target, watch):
-    makefile = ctx.obj
-    try:
-        made = makefile.invoke(target, watch=watch)
-    except MakeError as ex:
-        ctx.fail(ex)
-    except RuleExecutionError as ex:
-        ctx.fail('\n'.join([
-            f"something went wrong while making {ex.rule.targets[0]}:",
-            *ex.info.format()
-        ]))
+def make(ctx, target, watch, jobs, trace, summary, explain, explain_json, cache_dir, cache_size, processes,
+        reporter_name, events):
+    if watch and (trace or summary or explain or explain_json):
+        ctx.fail("--trace, --summary and --explain can't be used with --watch")
+    makefile = load_makefile(ctx)
+    makefile.action_cache = ActionCache(cache_dir, makefile.db, cache_size << 20)
+    makefile.loop.processes = processes or os.cpu_count()
+    if events is not None:
+        makefile.reporter = JsonLinesReporter(events)
     else:
-        if not made:
-            click.echo(f"nothing to do for {target}")
+        makefile.reporter = reporters[reporter_name]()
+    # json lines on stdout have to stay parseable, so everything meant for
+    # people (including whatever the rules print) goes to stderr instead
+    file = getattr(makefile.reporter, 'file', None)
+    to_stderr = file is not None and (file is sys.stdout or getattr(file, 'name', None) == '<stdout>')
+    echo = functools.partial(click.echo, err=to_stderr)
+    with contextlib.redirect_stdout(sys.stderr) if to_stderr else contextlib.nullcontext():
+        try:
+            made = makefile.invoke(target, watch=watch, jobs=jobs or os.cpu_count())
+        except MakeError as ex:
+            ctx.fail(ex)
+        except RuleExecutionError as ex:
+            ctx.fail('\n'.join([
+                f"something went wrong while making {ex.rule.targets[0]}:",
+                *ex.info.format()
+            ]))
+        else:
+            if not made:
+                echo(f"nothing to do for {target}")
+        finally:
+            if trace:
+                write_trace(trace, makefile.timings, makefile.checks)
+            if summary:
+                for line in timing_summary(makefile.timings, makefile.checks):
+                    echo(line)
+            if explain or explain_json:
+                ran = sorted(makefile.timings, key=lambda rule: makefile.timings[rule].start)
+                report = explain_rules(makefile, ran)
+                if explain:
+                    for line in explain_lines(report):
+                        echo(line)
+                if explain_json:
+                    with open(explain_json, 'w') as f:
+                        json.dump(report, f, indent=2)
 
 @pancake_cli.command(
     help="list rules defined by the build script")
@@ -452,13 +2115,19 @@ def make(ctx, target, watch):
     is_flag=True)
 @click.pass_context
 def list_rules(ctx, list_all):
-    makefile = ctx.obj
-    default = makefile.default_rule()
-    for rule in set(makefile.rules.values()):
-        if rule == default:
-            print(f"{rule.targets[0]} (default)")
-        elif list_all or not isinstance(rule, FileRule):
-            print(f"{rule.targets[0]}")
+    cache = RuleCache(os.path.join('.pancake', 'rules'))
+    cache.load(ctx.obj['filename'])
+    listing = cache.listing()
+    if listing is None:
+        makefile = load_makefile(ctx)
+        makefile.default_rule()
+        listing = [(rule.targets[0], isinstance(rule, FileRule))
+            for rule in dict.fromkeys(makefile.rules.values())]
+    for i, (name, is_file) in enumerate(listing):
+        if i == 0:
+            print(f"{name} (default)")
+        elif list_all or not is_file:
+            print(f"{name}")
 
 if __name__ == '__main__':
     pancake_cli()